@@ -0,0 +1,74 @@
+"""
+Benchmark: per-request httpx client vs the shared UpstreamPool client
+Usage: python bench/bench_client_pool.py [requests] [concurrency]
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+
+from stub_upstream import start_stub, stop_stub
+from upstream import UpstreamPool
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(fetch, url: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await fetch(url)
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+async def main(total: int, concurrency: int):
+    server, task, base_url = await start_stub()
+    url = f"{base_url}/api/etd.aspx"
+
+    async def per_request(target):
+        async with httpx.AsyncClient(timeout=15.0) as client:
+            return await client.get(target)
+
+    pool = UpstreamPool()
+    pool.register("stub", base_url)
+    await pool.start()
+
+    try:
+        results = {
+            "per_request_client": await run(per_request, url, total, concurrency),
+            "pooled_client": await run(pool.get("stub").get, url, total, concurrency),
+        }
+    finally:
+        await pool.close()
+        await stop_stub(server, task)
+
+    print(json.dumps({"requests": total, "concurrency": concurrency, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(total, concurrency))
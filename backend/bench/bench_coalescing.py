@@ -0,0 +1,55 @@
+"""
+Load test: upstream call count vs client concurrency for /api/departures/EMBR
+Fires N concurrent requests at a cold cache and counts how many reach the stub
+Usage: python bench/bench_coalescing.py [concurrency ...]
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+
+from stub_upstream import HITS, start_stub, stop_stub
+
+
+async def burst(app, path: str, concurrency: int) -> int:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+        responses = await asyncio.gather(*(client.get(path) for _ in range(concurrency)))
+    assert all(r.status_code == 200 for r in responses)
+    return len(responses)
+
+
+async def main(levels: list):
+    server, task, base_url = await start_stub()
+    os.environ["BART_BASE_URL"] = f"{base_url}/api"
+    os.environ["OPEN_METEO_BASE_URL"] = f"{base_url}/v1"
+    os.environ["OPEN_METEO_AQI_URL"] = f"{base_url}/v1"
+    # Exercise the on-demand per-station path rather than the background poller
+    os.environ["ETD_POLL_INTERVAL"] = "0"
+    import main as backend
+
+    results = []
+    try:
+        for path, upstream_path in [("/api/departures/EMBR", "/api/etd.aspx"),
+                                    ("/api/weather", "/v1/forecast"),
+                                    ("/api/aqi", "/v1/air-quality")]:
+            for concurrency in levels:
+                backend.response_cache.clear()
+                HITS.clear()
+                await burst(backend.app, path, concurrency)
+                results.append({"endpoint": path, "concurrency": concurrency, "upstream_calls": HITS[upstream_path]})
+    finally:
+        await backend.upstreams.close()
+        await stop_stub(server, task)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    levels = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500]
+    asyncio.run(main(levels))
@@ -0,0 +1,85 @@
+"""
+Benchmark: ETD history recorder ingest, disk use and delay queries
+Records one day of 30-second snapshots built from the synthetic orig=ALL
+fixture, copies it to the requested number of days, then times month-scale
+percentile queries
+Usage: python bench/bench_history.py [days]
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from history import INDEX, HistoryRecorder, _day_name
+from models import Departure
+from network import TripPlanner
+from stub_upstream import ETD_PAYLOAD
+
+POLL_INTERVAL = 30
+
+
+def snapshot_with_delays(seed: int = 13) -> dict:
+    rng = random.Random(seed)
+    return {
+        s["abbr"]: {"departures": tuple(
+            replace(Departure.from_bart(etd.get("destination"), est), delay=rng.choice((0, 0, 0, 0, 60, 120, 300)))
+            for etd in s.get("etd", [])
+            for est in etd.get("estimate", [])
+        )}
+        for s in ETD_PAYLOAD["root"]["station"]
+    }
+
+
+def run(days: int) -> dict:
+    planner = TripPlanner()
+    directory = tempfile.mkdtemp(prefix="etd-history-")
+    try:
+        recorder = HistoryRecorder(directory, stations=sorted(planner.at_station), terminal=planner.terminal,
+                                   retention_days=days + 1)
+        snapshot = snapshot_with_delays()
+        now = time.time()
+        first = now - now % 86400 - 86400
+        polls = 86400 // POLL_INTERVAL
+        start = time.perf_counter()
+        for i in range(polls):
+            recorder.record(snapshot, first + i * POLL_INTERVAL)
+        ingest_us = (time.perf_counter() - start) / polls * 1e6
+        recorder.close()
+
+        # Further days are copies of the first one, shifted back in time
+        source = os.path.join(directory, _day_name(first))
+        for k in range(1, days):
+            target = os.path.join(directory, _day_name(first - k * 86400))
+            shutil.copytree(source, target)
+            ts = np.fromfile(os.path.join(target, "ts"), dtype=INDEX["ts"])
+            (ts - k * 86400).astype(INDEX["ts"]).tofile(os.path.join(target, "ts"))
+
+        def query_ms(station=None) -> float:
+            start = time.perf_counter()
+            recorder.delay_stats(now - (days + 1) * 86400, now, station)
+            return round((time.perf_counter() - start) * 1000, 1)
+
+        stats = recorder.stats()
+        return {
+            "days": days,
+            "rows": stats["rows"] * days,
+            "bytes": stats["bytes"],
+            "bytes_per_row": round(stats["bytes"] / (stats["rows"] * days), 2),
+            "ingest_us_per_snapshot": round(ingest_us, 1),
+            "query_ms": {"one_station": query_ms("EMBR"), "all_stations": query_ms()},
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(int(sys.argv[1]) if len(sys.argv) > 1 else 30), indent=2))
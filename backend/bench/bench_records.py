@@ -0,0 +1,117 @@
+"""
+Micro-benchmark: slotted Station/Departure records vs plain dicts
+Normalizes the synthetic orig=ALL ETD and station fixtures both ways and
+reports retained memory, normalize time and serialize time
+Usage: python bench/bench_records.py [copies]
+"""
+
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import Departure, Station
+from serialize import ORJSON_AVAILABLE, dumps
+from stub_upstream import ETD_PAYLOAD, STATIONS_PAYLOAD
+
+
+def departures_as_dicts(payload: dict) -> dict:
+    """The previous dict-per-estimate normalization, kept here for comparison"""
+    return {
+        s["abbr"]: [
+            {
+                "destination": etd.get("destination"),
+                "minutes": est.get("minutes"),
+                "platform": est.get("platform"),
+                "direction": est.get("direction"),
+                "length": est.get("length"),
+                "color": est.get("color"),
+                "hexcolor": est.get("hexcolor"),
+                "delay": est.get("delay"),
+            }
+            for etd in s.get("etd", [])
+            for est in etd.get("estimate", [])
+        ]
+        for s in payload["root"]["station"]
+    }
+
+
+def departures_as_records(payload: dict) -> dict:
+    return {
+        s["abbr"]: tuple(
+            Departure.from_bart(etd.get("destination"), est)
+            for etd in s.get("etd", [])
+            for est in etd.get("estimate", [])
+        )
+        for s in payload["root"]["station"]
+    }
+
+
+def stations_as_dicts(payload: dict) -> list:
+    return [
+        {
+            "abbr": s.get("abbr"),
+            "name": s.get("name"),
+            "lat": float(s.get("gtfs_latitude", 0)),
+            "lon": float(s.get("gtfs_longitude", 0)),
+            "address": s.get("address"),
+            "city": s.get("city"),
+            "zipcode": s.get("zipcode"),
+        }
+        for s in payload["root"]["stations"]["station"]
+    ]
+
+
+def stations_as_records(payload: dict) -> list:
+    return [Station.from_bart(s) for s in payload["root"]["stations"]["station"]]
+
+
+def retained_bytes(build, payloads: list) -> int:
+    """Memory still allocated after building one result per payload"""
+    gc.collect()
+    tracemalloc.start()
+    results = [build(payload) for payload in payloads]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return size
+
+
+def per_call_us(fn, number: int = 200) -> float:
+    return round(min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6, 1)
+
+
+def compare(name: str, payload: dict, as_dicts, as_records, copies: int) -> dict:
+    # Fresh parses, as each poll would produce, so no strings are shared between copies
+    raw = json.dumps(payload)
+    payloads = [json.loads(raw) for _ in range(copies)]
+    dict_result, record_result = as_dicts(payload), as_records(payload)
+    return {
+        "fixture": name,
+        "copies": copies,
+        "retained_bytes": {
+            "dicts": retained_bytes(as_dicts, payloads),
+            "records": retained_bytes(as_records, payloads),
+        },
+        "normalize_us": {
+            "dicts": per_call_us(lambda: as_dicts(payload)),
+            "records": per_call_us(lambda: as_records(payload)),
+        },
+        "serialize_us": {
+            "dicts": per_call_us(lambda: dumps(dict_result)),
+            "records": per_call_us(lambda: dumps(record_result)),
+        },
+        "orjson": ORJSON_AVAILABLE,
+    }
+
+
+if __name__ == "__main__":
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(json.dumps([
+        compare("etd_all.json", ETD_PAYLOAD, departures_as_dicts, departures_as_records, copies),
+        compare("stn.json", STATIONS_PAYLOAD, stations_as_dicts, stations_as_records, copies),
+    ], indent=2))
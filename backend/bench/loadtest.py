@@ -0,0 +1,233 @@
+"""
+Reproducible load test for the backend against local upstream stubs
+Drives the FastAPI app at a fixed concurrency per endpoint and reports RPS,
+latency percentiles and upstream calls as JSON; --baseline compares against
+an earlier report and exits non-zero on regressions.
+Usage: python bench/loadtest.py [--requests 500] [--concurrency 50] [--output run.json]
+                                [--baseline base.json] [--endpoint PATH ...]
+Backend settings (e.g. ETD_POLL_INTERVAL=0) are read from the environment as usual.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+
+import stub_upstream
+from stub_upstream import ERRORS, HITS, start_stub, stop_stub
+
+DEFAULT_ENDPOINTS = [
+    "/api/stations",
+    "/api/departures/EMBR",
+    "/api/departures?stations=EMBR,MONT,POWL,CIVC,16TH",
+    "/api/weather",
+    "/api/aqi",
+    "/api/conditions?station=12TH",
+    "/api/nearest?lat=37.7793&lon=-122.4193&k=3",
+    "/api/search?q=1+Market+Street",
+]
+
+
+def percentile(ordered: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_endpoint(client: httpx.AsyncClient, path: str, requests: int, concurrency: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await client.get(path)
+
+    stub_upstream.reset()
+    latencies = []
+    statuses = {}
+    sources = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                response, status = None, type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if response is not None and response.headers.get("content-type", "").startswith("application/json"):
+                body = response.json()
+                if isinstance(body, dict) and "source" in body:
+                    sources[body["source"]] = sources.get(body["source"], 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latency * 1000 for latency in latencies)
+    return {
+        "requests": len(ordered),
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "status_codes": statuses,
+        "sources": sources,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50), 3),
+            "p95": round(percentile(ordered, 95), 3),
+            "p99": round(percentile(ordered, 99), 3),
+            "max": round(ordered[-1], 3) if ordered else 0.0,
+        },
+        "upstream_calls": dict(sorted(HITS.items())),
+        "upstream_errors": dict(sorted(ERRORS.items())),
+    }
+
+
+async def wait_ready(backend, timeout: float = 10.0):
+    """Wait for the startup warm-up, as a readiness probe would, and the first ETD snapshot"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and (
+        not backend.warmup.ready or (backend.etd_poller.enabled and not backend.etd_poller.ready)
+    ):
+        await asyncio.sleep(0.05)
+
+
+async def run(args) -> dict:
+    stub_upstream.configure(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                            error_rate=args.error_rate, seed=args.seed)
+    stub_server, stub_task, stub_url = await start_stub()
+    os.environ["BART_BASE_URL"] = f"{stub_url}/api"
+    os.environ["OPEN_METEO_BASE_URL"] = f"{stub_url}/v1"
+    os.environ["OPEN_METEO_AQI_URL"] = f"{stub_url}/v1"
+    os.environ["NOMINATIM_BASE_URL"] = stub_url
+    # Fresh geocode cache per run so search starts cold every time
+    workdir = tempfile.TemporaryDirectory()
+    os.environ["GEOCODE_CACHE_PATH"] = os.path.join(workdir.name, "geocode.sqlite3")
+    import main as backend
+
+    results = {}
+    try:
+        if args.transport == "http":
+            # Full HTTP stack: uvicorn runs the app (and its lifespan) on a local port
+            app_server, app_task, app_url = await start_stub(backend.app)
+            lifespan = None
+            client = httpx.AsyncClient(base_url=app_url, timeout=30.0,
+                                       limits=httpx.Limits(max_connections=args.concurrency))
+        else:
+            lifespan = backend.lifespan(backend.app)
+            await lifespan.__aenter__()
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://app", timeout=30.0)
+        await wait_ready(backend)
+
+        async with client:
+            for path in args.endpoint or DEFAULT_ENDPOINTS:
+                results[path] = await run_endpoint(client, path, args.requests, args.concurrency, args.warmup)
+
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        else:
+            await stop_stub(app_server, app_task)
+    finally:
+        await stop_stub(stub_server, stub_task)
+        workdir.cleanup()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": args.transport,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "stub": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms,
+                     "error_rate": args.error_rate, "seed": args.seed},
+        },
+        "endpoints": results,
+    }
+
+
+def compare(baseline: dict, report: dict, threshold: float) -> list:
+    """Endpoints whose RPS dropped or p95 or upstream calls grew by more than threshold percent"""
+    regressions = []
+    for path, current in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(path)
+        if before is None:
+            continue
+        checks = [
+            ("rps", before["rps"], current["rps"], -1),
+            ("p95_ms", before["latency_ms"]["p95"], current["latency_ms"]["p95"], 1),
+            ("upstream_calls", sum(before["upstream_calls"].values()), sum(current["upstream_calls"].values()), 1),
+        ]
+        for metric, old, new, worse in checks:
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            if change * worse > threshold:
+                regressions.append({"endpoint": path, "metric": metric, "baseline": old, "current": new,
+                                    "change_pct": round(change, 1)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent client workers")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint first")
+    parser.add_argument("--endpoint", action="append", help="path to test (repeatable; default: hot endpoints)")
+    parser.add_argument("--transport", choices=["asgi", "http"], default="asgi",
+                        help="asgi calls the app in-process; http goes through uvicorn")
+    parser.add_argument("--latency-ms", type=float, default=stub_upstream.STUB_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=stub_upstream.STUB_JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=stub_upstream.STUB_ERROR_RATE)
+    parser.add_argument("--seed", type=int, default=stub_upstream.STUB_SEED)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Numbers are only comparable between runs with the same load and stub settings
+        settings = ("transport", "requests", "concurrency", "stub")
+        report["baseline"] = {
+            "commit": baseline["meta"].get("commit"),
+            "settings_differ": [key for key in settings if baseline["meta"].get(key) != report["meta"][key]],
+        }
+        report["regressions"] = compare(baseline, report, args.threshold)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Generate the synthetic BART stub fixtures
+Builds bench/fixtures/stn.json and etd_all.json from the fallback station list
+and the bundled line graph (network.BART_LINES), so every train runs on a real
+line towards one of its terminals and the same train is seen at each station
+it passes at consistent times. Use record_fixtures.py instead when the live
+APIs are reachable.
+Usage: python bench/make_fixtures.py
+"""
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import FALLBACK_STATIONS
+from network import TripPlanner
+from stub_upstream import FIXTURES_DIR
+
+SEED = 13
+
+# Fixed so regenerating gives byte-identical files
+DATE, TIME = "01/14/2026", "08:15:00 AM PST"
+
+# Left out of FALLBACK_STATIONS but served by the Red and Orange lines
+EXTRA_STATIONS = [
+    {"abbr": "ASHB", "name": "Ashby", "lat": 37.852803, "lon": -122.270062, "city": "Berkeley"},
+]
+
+COUNTIES = {
+    "Antioch": "contracosta", "Concord": "contracosta", "El Cerrito": "contracosta",
+    "Lafayette": "contracosta", "Orinda": "contracosta", "Pittsburg": "contracosta",
+    "Richmond": "contracosta", "Walnut Creek": "contracosta",
+    "San Francisco": "sanfrancisco",
+    "Colma": "sanmateo", "Daly City": "sanmateo", "Millbrae": "sanmateo", "San Bruno": "sanmateo",
+    "South San Francisco": "sanmateo",
+    "Milpitas": "santaclara", "San Jose": "santaclara",
+}
+
+# Destination names as BART signs them; other terminals use the station name
+HEADSIGNS = {"SFIA": "SF Airport", "BERY": "Berryessa", "OAKL": "OAK Airport"}
+
+# Estimates listed per destination (soonest first, any line), and how far ahead they reach
+TRAINS_PER_DESTINATION = 3
+HORIZON_MINUTES = 60
+
+
+def stations() -> list:
+    rows = [
+        {"abbr": s.abbr, "name": s.name, "lat": s.lat, "lon": s.lon, "city": s.city}
+        for s in FALLBACK_STATIONS
+    ] + EXTRA_STATIONS
+    return sorted(rows, key=lambda s: s["abbr"])
+
+
+def stn_payload(rows: list) -> dict:
+    return {
+        "?xml": {"@version": "1.0", "@encoding": "utf-8"},
+        "root": {
+            "uri": {"#cdata-section": "http://api.bart.gov/api/stn.aspx?cmd=stns&json=y"},
+            "stations": {"station": [
+                {
+                    "name": s["name"],
+                    "abbr": s["abbr"],
+                    "gtfs_latitude": f"{s['lat']:.6f}",
+                    "gtfs_longitude": f"{s['lon']:.6f}",
+                    "address": "",
+                    "city": s["city"],
+                    "county": COUNTIES.get(s["city"], "alameda"),
+                    "state": "CA",
+                    "zipcode": "",
+                }
+                for s in rows
+            ]},
+            "message": "",
+        },
+    }
+
+
+def etd_payload(rows: list, planner: TripPlanner, rng: random.Random) -> dict:
+    names = {s["abbr"]: s["name"] for s in rows}
+    # abbr -> destination abbr -> estimates
+    boards = {s["abbr"]: {} for s in rows}
+    for p, pattern in enumerate(planner.patterns):
+        # Patterns alternate forward (as listed in BART_LINES) and reverse
+        direction, platform = ("South", "2") if p % 2 == 0 else ("North", "1")
+        terminal = pattern.stations[-1]
+        phase = rng.randrange(pattern.headway)
+        elapsed = 0
+        for i, abbr in enumerate(pattern.stations[:-1]):
+            elapsed += pattern.minutes[i]
+            # Trains leave the first station every headway minutes; this station sees them elapsed minutes later
+            first = (phase + elapsed) % pattern.headway
+            for minutes in range(first, HORIZON_MINUTES + 1, pattern.headway):
+                boards[abbr].setdefault(terminal, []).append({
+                    "minutes": "Leaving" if minutes == 0 else str(minutes),
+                    "platform": platform,
+                    "direction": direction,
+                    "length": str(rng.choice((6, 8, 9, 10))),
+                    "color": pattern.color,
+                    "hexcolor": pattern.hexcolor,
+                    "bikeflag": "1",
+                    "delay": str(rng.choice((0, 0, 0, 0, 0, 0, 60, 120, 300))),
+                    "cancelflag": "0",
+                    "dynamicflag": "0",
+                })
+
+    def sort_key(estimate):
+        return 0 if estimate["minutes"] == "Leaving" else int(estimate["minutes"])
+
+    return {
+        "?xml": {"@version": "1.0", "@encoding": "utf-8"},
+        "root": {
+            "uri": {"#cdata-section": "http://api.bart.gov/api/etd.aspx?cmd=etd&orig=ALL&json=y"},
+            "date": DATE,
+            "time": TIME,
+            "station": [
+                {
+                    "name": names[abbr],
+                    "abbr": abbr,
+                    "etd": sorted((
+                        {
+                            "destination": HEADSIGNS.get(dest, names[dest]),
+                            "abbreviation": dest,
+                            "limited": "0",
+                            "estimate": sorted(estimates, key=sort_key)[:TRAINS_PER_DESTINATION],
+                        }
+                        for dest, estimates in board.items()
+                    ), key=lambda etd: etd["destination"]),
+                }
+                for abbr, board in sorted(boards.items())
+            ],
+            "message": "",
+        },
+    }
+
+
+def main():
+    rows = stations()
+    planner = TripPlanner(names={s["abbr"]: s["name"] for s in rows})
+    payloads = {
+        "stn.json": stn_payload(rows),
+        "etd_all.json": etd_payload(rows, planner, random.Random(SEED)),
+    }
+    for name, payload in payloads.items():
+        with open(os.path.join(FIXTURES_DIR, name), "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=1, ensure_ascii=False)
+        print(f"{name}: {os.path.getsize(os.path.join(FIXTURES_DIR, name))} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Re-record the stub upstream fixtures from the live APIs
+Overwrites bench/fixtures/*.json so benchmarks replay current payload shapes
+Usage: python bench/record_fixtures.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+
+from stub_upstream import FIXTURES_DIR
+
+BART_API_KEY = os.getenv("BART_API_KEY", "MW9S-E7SL-26DU-VV8V")
+
+# fixture file -> (url, params)
+RECORDINGS = {
+    "stn.json": ("https://api.bart.gov/api/stn.aspx", {"cmd": "stns", "key": BART_API_KEY, "json": "y"}),
+    "etd_all.json": ("https://api.bart.gov/api/etd.aspx", {"cmd": "etd", "orig": "ALL", "key": BART_API_KEY, "json": "y"}),
+    "forecast.json": ("https://api.open-meteo.com/v1/forecast", {
+        "latitude": 37.78, "longitude": -122.42, "current_weather": "true",
+        "hourly": "precipitation,rain", "timezone": "America/Los_Angeles", "forecast_days": 1,
+    }),
+    "air_quality.json": ("https://air-quality-api.open-meteo.com/v1/air-quality", {
+        "latitude": 37.78, "longitude": -122.42,
+        "current": "us_aqi,pm10,pm2_5,carbon_monoxide,nitrogen_dioxide,ozone",
+        "timezone": "America/Los_Angeles",
+    }),
+    "nominatim_search.json": ("https://nominatim.openstreetmap.org/search", {
+        "q": "Market Street, San Francisco", "format": "json", "limit": 5, "addressdetails": 1,
+    }),
+}
+
+
+async def main():
+    headers = {"User-Agent": "SmartBayCommute/1.0 (benchmark fixtures)"}
+    async with httpx.AsyncClient(headers=headers, timeout=20.0) as client:
+        for name, (url, params) in RECORDINGS.items():
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+            with open(os.path.join(FIXTURES_DIR, name), "w", encoding="utf-8") as f:
+                json.dump(response.json(), f, indent=1, ensure_ascii=False)
+            print(f"{name}: {len(response.content)} bytes")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""
+Local upstream stub server for benchmarks
+Replays synthetic BART, Open Meteo and Nominatim payloads from bench/fixtures
+on localhost, with configurable latency, jitter and error injection
+"""
+
+import asyncio
+import copy
+import json
+import os
+import random
+import socket
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Artificial upstream latency in milliseconds, plus up to this much uniform jitter
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "5"))
+STUB_JITTER_MS = float(os.getenv("STUB_JITTER_MS", "0"))
+
+# Fraction of upstream calls answered with STUB_ERROR_STATUS instead of a payload
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "503"))
+
+# Seed for jitter and error injection so runs are repeatable
+STUB_SEED = int(os.getenv("STUB_SEED", "13"))
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+STATIONS_PAYLOAD = load_fixture("stn.json")
+ETD_PAYLOAD = load_fixture("etd_all.json")
+FORECAST_PAYLOAD = load_fixture("forecast.json")
+AIR_QUALITY_PAYLOAD = load_fixture("air_quality.json")
+SEARCH_PAYLOAD = load_fixture("nominatim_search.json")
+
+# orig=ALL departures split per station for orig=<abbr> requests
+ETD_BY_STATION = {s["abbr"]: s for s in ETD_PAYLOAD["root"]["station"]}
+
+stub = FastAPI()
+
+# Upstream calls received, per path
+HITS = Counter()
+
+# Injected failures, per path
+ERRORS = Counter()
+
+rng = random.Random(STUB_SEED)
+
+
+def configure(latency_ms: float = None, jitter_ms: float = None, error_rate: float = None,
+              error_status: int = None, seed: int = None):
+    """Change injection settings at runtime (e.g. from a load test's CLI args)"""
+    global STUB_LATENCY_MS, STUB_JITTER_MS, STUB_ERROR_RATE, STUB_ERROR_STATUS
+    if latency_ms is not None:
+        STUB_LATENCY_MS = latency_ms
+    if jitter_ms is not None:
+        STUB_JITTER_MS = jitter_ms
+    if error_rate is not None:
+        STUB_ERROR_RATE = error_rate
+    if error_status is not None:
+        STUB_ERROR_STATUS = error_status
+    if seed is not None:
+        rng.seed(seed)
+
+
+def reset():
+    HITS.clear()
+    ERRORS.clear()
+
+
+@stub.middleware("http")
+async def inject(request, call_next):
+    HITS[request.url.path] += 1
+    delay = STUB_LATENCY_MS + (rng.uniform(0, STUB_JITTER_MS) if STUB_JITTER_MS else 0)
+    fail = STUB_ERROR_RATE > 0 and rng.random() < STUB_ERROR_RATE
+    if delay:
+        await asyncio.sleep(delay / 1000)
+    if fail:
+        ERRORS[request.url.path] += 1
+        return JSONResponse({"error": "injected failure"}, status_code=STUB_ERROR_STATUS)
+    return await call_next(request)
+
+
+@stub.get("/api/stn.aspx")
+async def stations():
+    return STATIONS_PAYLOAD
+
+
+@stub.get("/api/etd.aspx")
+async def etd(orig: str = "ALL"):
+    orig = orig.upper()
+    if orig == "ALL":
+        return ETD_PAYLOAD
+    payload = copy.copy(ETD_PAYLOAD["root"])
+    station = ETD_BY_STATION.get(orig)
+    payload["station"] = [station] if station else []
+    return {"root": payload}
+
+
+def _per_coordinate(request: Request, payload: dict):
+    """Open Meteo answers comma-separated coordinates with a list"""
+    latitudes = request.query_params.get("latitude", "").split(",")
+    longitudes = request.query_params.get("longitude", "").split(",")
+    if len(latitudes) == 1:
+        return payload
+    return [{**payload, "latitude": float(lat), "longitude": float(lon)} for lat, lon in zip(latitudes, longitudes)]
+
+
+@stub.get("/v1/forecast")
+async def forecast(request: Request):
+    return _per_coordinate(request, FORECAST_PAYLOAD)
+
+
+@stub.get("/v1/air-quality")
+async def air_quality(request: Request):
+    return _per_coordinate(request, AIR_QUALITY_PAYLOAD)
+
+
+@stub.get("/search")
+async def search():
+    return SEARCH_PAYLOAD
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_stub(app: FastAPI = stub, port: int = 0) -> tuple:
+    """Run an app with uvicorn in the current loop; returns (server, task, base_url)"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def stop_stub(server: uvicorn.Server, task: asyncio.Task):
+    server.should_exit = True
+    await task
+
+
+if __name__ == "__main__":
+    uvicorn.run(stub, host="127.0.0.1", port=int(os.getenv("STUB_PORT", "8900")))
@@ -0,0 +1,121 @@
+"""
+In-process async response cache
+TTL expiry, LRU eviction bounded by entry count and approximate size,
+and stale-while-revalidate with a single background refresh per key
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+def estimate_size(value) -> int:
+    """Approximate memory footprint of a JSON-like value (encoded length)"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class ResponseCache:
+    """LRU cache of upstream results with stale-while-revalidate"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, stored_at, ttl, stale_ttl, size)
+        self.total_bytes = 0
+        self.refreshing = {}
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "refreshes": 0, "refresh_errors": 0, "evictions": 0}
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable], ttl: float,
+                           stale_ttl: Optional[float] = None):
+        """
+        Return the cached value for key, calling fetch() on a miss.
+        Within ttl the value is fresh; for stale_ttl seconds after that it is
+        served as-is while one background refresh runs. Errors from fetch()
+        propagate and are never cached.
+        """
+        stale_ttl = ttl if stale_ttl is None else stale_ttl
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, stored_at, _, _, _ = entry
+            age = time.monotonic() - stored_at
+            if age < ttl:
+                self.counters["hits"] += 1
+                self.entries.move_to_end(key)
+                return value
+            if age < ttl + stale_ttl:
+                self.counters["stale"] += 1
+                self.entries.move_to_end(key)
+                self._refresh(key, fetch, ttl, stale_ttl)
+                return value
+
+        self.counters["misses"] += 1
+        value = await fetch()
+        self.set(key, value, ttl, stale_ttl)
+        return value
+
+    def set(self, key: str, value, ttl: float, stale_ttl: float = 0):
+        """Store a value, evicting least recently used entries past the bounds"""
+        self.invalidate(key)
+        size = estimate_size(value)
+        self.entries[key] = (value, time.monotonic(), ttl, stale_ttl, size)
+        self.total_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted[4]
+            self.counters["evictions"] += 1
+
+    def invalidate(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[4]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def _refresh(self, key: str, fetch: Callable[[], Awaitable], ttl: float, stale_ttl: float):
+        """Start a background refresh unless one is already running for key"""
+        if key in self.refreshing:
+            return
+
+        async def refresh():
+            try:
+                self.set(key, await fetch(), ttl, stale_ttl)
+                self.counters["refreshes"] += 1
+            except Exception:
+                # Keep serving the stale value until it ages out
+                self.counters["refresh_errors"] += 1
+            finally:
+                self.refreshing.pop(key, None)
+
+        self.refreshing[key] = asyncio.create_task(refresh())
+
+    async def close(self):
+        """Cancel background refreshes (called on shutdown)"""
+        tasks = list(self.refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.refreshing.clear()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["stale"]
+        return {
+            **self.counters,
+            "hit_ratio": round((self.counters["hits"] + self.counters["stale"]) / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "refreshing": len(self.refreshing),
+            "keys": {
+                key: {"age": round(now - stored_at, 1), "ttl": ttl, "stale": now - stored_at >= ttl}
+                for key, (_, stored_at, ttl, _, _) in self.entries.items()
+            },
+        }
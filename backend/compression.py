@@ -0,0 +1,148 @@
+"""
+Response compression
+ASGI middleware compressing response bodies above a size threshold with
+brotli (when installed and accepted) or gzip. Sits inside the ETag
+middleware, so a 304 repeats the ETag and Vary of the compressed 200 it
+revalidates. A route's own ETag describes the uncompressed body; a compressed
+response carries its weak form, so revalidation works across encodings.
+Tags the ETag middleware hashes itself are taken over the compressed bytes.
+"""
+
+import gzip
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import REGISTRY, stage_timer
+
+try:
+    import brotli
+except ImportError:  # gzip only; pip install brotli to offer br
+    brotli = None
+
+COMPRESSED_BYTES = REGISTRY.counter("http_compressed_bytes_total", "Response bytes before and after compression",
+                                    ("encoding", "stage"))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Codings with a non-zero q value in an Accept-Encoding header"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON and text responses of at least min_size bytes. Event streams,
+    already encoded bodies and HEAD responses pass through untouched. Bodies with
+    a strong ETag (a hash of the exact bytes, e.g. /api/stations) have their
+    compressed form memoized by tag, LRU up to max_bytes; bodies with volatile
+    fields (weak ETag, e.g. snapshot_age) rarely repeat and are not memoized.
+    """
+
+    def __init__(self, app, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 max_bytes: int = 4 * 1024 * 1024):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.max_bytes = max_bytes
+        self.memo = OrderedDict()  # (encoding, strong etag) -> compressed body
+        self.memo_bytes = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+        accepted = accepted_encodings(accept)
+        encoding = "br" if brotli is not None and "br" in accepted else "gzip" if "gzip" in accepted else None
+
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if start is None and message["type"] == "http.response.start":
+                headers = message.get("headers", ())
+                content_type = next((value for name, value in headers if name == b"content-type"), b"")
+                if (not content_type.startswith(COMPRESSIBLE_TYPES)
+                        or content_type.startswith(b"text/event-stream")
+                        or any(name == b"content-encoding" for name, _ in headers)):
+                    start = False
+                    await send(message)
+                    return
+                start = message
+                return
+            if not start or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._finish(start, b"".join(chunks), encoding, send)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compress(self, body: bytes, encoding: str, etag: Optional[bytes]) -> bytes:
+        key = (encoding, etag) if etag is not None and not etag.startswith(b"W/") else None
+        compressed = self.memo.get(key) if key is not None else None
+        if compressed is not None:
+            self.memo.move_to_end(key)
+            return compressed
+        with stage_timer("compress"):
+            if encoding == "br":
+                compressed = brotli.compress(body, quality=self.brotli_quality)
+            else:
+                compressed = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        if key is not None and len(compressed) <= self.max_bytes:
+            self.memo[key] = compressed
+            self.memo_bytes += len(compressed)
+            while self.memo_bytes > self.max_bytes:
+                self.memo_bytes -= len(self.memo.popitem(last=False)[1])
+        return compressed
+
+    async def _finish(self, start: dict, body: bytes, encoding: Optional[str], send):
+        headers = list(start.get("headers", ()))
+        if len(body) < self.min_size:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # Large enough to compress for someone, so shared caches must key on Accept-Encoding
+        vary = [value for name, value in headers if name == b"vary"]
+        headers = [(name, value) for name, value in headers if name != b"vary"]
+        headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"]) if vary else b"Accept-Encoding"))
+
+        if encoding is not None:
+            etag = next((value for name, value in headers if name == b"etag"), None)
+            compressed = self._compress(body, encoding, etag)
+            if len(compressed) < len(body):
+                COMPRESSED_BYTES.inc(len(body), encoding=encoding, stage="before")
+                COMPRESSED_BYTES.inc(len(compressed), encoding=encoding, stage="after")
+                headers = [
+                    (name, b"W/" + value if name == b"etag" and not value.startswith(b"W/") else value)
+                    for name, value in headers if name != b"content-length"
+                ]
+                headers += [(b"content-encoding", encoding.encode("latin-1")),
+                            (b"content-length", str(len(compressed)).encode("latin-1"))]
+                body = compressed
+
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
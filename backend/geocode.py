@@ -0,0 +1,245 @@
+"""
+Local geocoding layer in front of Nominatim
+- LocalPlaceIndex: prefix + fuzzy matching over station names and SF landmarks
+- GeocodeCache: persistent SQLite cache of upstream results with TTL and LRU bound
+- TokenBucket: async rate limiter that queues callers, up to a maximum wait
+"""
+
+import asyncio
+import difflib
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+
+# Seeded gazetteer of common San Francisco landmarks (name, lat, lon, type)
+SF_LANDMARKS = [
+    ("Golden Gate Bridge", 37.8199, -122.4783, "bridge"),
+    ("Ferry Building", 37.7955, -122.3937, "attraction"),
+    ("Union Square", 37.7880, -122.4075, "square"),
+    ("Fisherman's Wharf", 37.8080, -122.4177, "neighbourhood"),
+    ("Pier 39", 37.8087, -122.4098, "attraction"),
+    ("Alcatraz Landing (Pier 33)", 37.8067, -122.4040, "ferry_terminal"),
+    ("Coit Tower", 37.8024, -122.4058, "attraction"),
+    ("Lombard Street", 37.8021, -122.4187, "attraction"),
+    ("Ghirardelli Square", 37.8059, -122.4228, "attraction"),
+    ("Chinatown", 37.7941, -122.4078, "neighbourhood"),
+    ("North Beach", 37.8061, -122.4103, "neighbourhood"),
+    ("Mission District", 37.7599, -122.4148, "neighbourhood"),
+    ("Dolores Park", 37.7596, -122.4269, "park"),
+    ("The Castro", 37.7609, -122.4350, "neighbourhood"),
+    ("Haight-Ashbury", 37.7692, -122.4481, "neighbourhood"),
+    ("Alamo Square (Painted Ladies)", 37.7763, -122.4328, "park"),
+    ("Twin Peaks", 37.7544, -122.4477, "peak"),
+    ("Golden Gate Park", 37.7694, -122.4862, "park"),
+    ("de Young Museum", 37.7715, -122.4687, "museum"),
+    ("California Academy of Sciences", 37.7699, -122.4661, "museum"),
+    ("Ocean Beach", 37.7594, -122.5107, "beach"),
+    ("Presidio", 37.7989, -122.4662, "park"),
+    ("Crissy Field", 37.8039, -122.4640, "park"),
+    ("Palace of Fine Arts", 37.8029, -122.4484, "attraction"),
+    ("Japantown", 37.7854, -122.4294, "neighbourhood"),
+    ("San Francisco City Hall", 37.7793, -122.4193, "townhall"),
+    ("Moscone Center", 37.7842, -122.4016, "conference_centre"),
+    ("SFMOMA", 37.7857, -122.4011, "museum"),
+    ("Salesforce Tower", 37.7897, -122.3972, "building"),
+    ("Salesforce Transit Center", 37.7895, -122.3960, "station"),
+    ("Transamerica Pyramid", 37.7952, -122.4028, "building"),
+    ("Embarcadero Center", 37.7950, -122.3990, "mall"),
+    ("Exploratorium", 37.8015, -122.3975, "museum"),
+    ("Oracle Park", 37.7786, -122.3893, "stadium"),
+    ("Chase Center", 37.7680, -122.3877, "stadium"),
+    ("UCSF Mission Bay", 37.7680, -122.3920, "university"),
+    ("Caltrain 4th & King", 37.7766, -122.3947, "station"),
+    ("San Francisco State University", 37.7241, -122.4799, "university"),
+    ("Stonestown Galleria", 37.7285, -122.4775, "mall"),
+    ("Zuckerberg San Francisco General Hospital", 37.7556, -122.4047, "hospital"),
+]
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+
+class LocalPlaceIndex:
+    """Prefix and fuzzy name matching over a small, fixed set of places"""
+
+    def __init__(self, places: Iterable[dict] = ()):
+        self.load(places)
+
+    def load(self, places: Iterable[dict]):
+        """places: dicts with name, lat, lon and type"""
+        self.places = list(places)
+        self.names = [normalize_query(p["name"]) for p in self.places]
+        self.prefixes = {}
+        for index, name in enumerate(self.names):
+            for token in name.split():
+                for end in range(1, len(token) + 1):
+                    self.prefixes.setdefault(token[:end], set()).add(index)
+        self.vocabulary = sorted({token for name in self.names for token in name.split()})
+
+    def _prefix_matches(self, tokens: List[str]) -> set:
+        matches = None
+        for token in tokens:
+            ids = self.prefixes.get(token, set())
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return set()
+        return matches or set()
+
+    def search(self, query: str, limit: int = 5) -> List[dict]:
+        """Places whose name matches every query token by prefix, else fuzzily"""
+        normalized = normalize_query(query)
+        tokens = normalized.split()
+        if not tokens:
+            return []
+
+        scored = {}
+        for index in self._prefix_matches(tokens):
+            name = self.names[index]
+            scored[index] = 1.0 if name == normalized else 0.95 if name.startswith(normalized) else 0.9
+
+        if not scored:
+            # Typo tolerance: correct each token against the known vocabulary
+            corrected = []
+            for token in tokens:
+                close = difflib.get_close_matches(token, self.vocabulary, n=1, cutoff=0.75)
+                corrected.append(close[0] if close else token)
+            for index in self._prefix_matches(corrected):
+                scored[index] = round(0.8 * difflib.SequenceMatcher(None, normalized, self.names[index]).ratio() + 0.1, 3)
+
+        ranked = sorted(scored.items(), key=lambda item: (-item[1], self.names[item[0]]))[:limit]
+        return [{**self.places[index], "importance": score} for index, score in ranked]
+
+
+class GeocodeCache:
+    """
+    SQLite-backed cache of geocoding results keyed by normalized query.
+    Methods block on disk, so async callers run them in an executor; a lock
+    serializes the worker threads on the one connection. The connection is
+    opened on first use so it is never inherited across fork().
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self.db = None
+        self.lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " query TEXT PRIMARY KEY, results TEXT NOT NULL,"
+                " stored_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+        return self.db
+
+    def get(self, query: str) -> Optional[list]:
+        with self.lock:
+            db = self._conn()
+            row = db.execute("SELECT results, stored_at FROM geocode WHERE query = ?", (query,)).fetchone()
+            now = time.time()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            if now - row[1] > self.ttl:
+                self.counters["expired"] += 1
+                db.execute("DELETE FROM geocode WHERE query = ?", (query,))
+                return None
+            self.counters["hits"] += 1
+            db.execute("UPDATE geocode SET last_used = ? WHERE query = ?", (now, query))
+            return json.loads(row[0])
+
+    def put(self, query: str, results: list):
+        now = time.time()
+        with self.lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO geocode (query, results, stored_at, last_used) VALUES (?, ?, ?, ?)",
+                (query, json.dumps(results), now, now),
+            )
+            count = db.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            if count > self.max_entries:
+                # Evict down to 90% so eviction doesn't run on every insert
+                excess = count - int(self.max_entries * 0.9)
+                db.execute(
+                    "DELETE FROM geocode WHERE query IN (SELECT query FROM geocode ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self.counters["evictions"] += excess
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self._conn().execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        return {
+            **self.counters,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+class RateLimitExceeded(Exception):
+    """A TokenBucket caller would have to wait longer than max_wait"""
+
+    def __init__(self, wait: float):
+        super().__init__(f"rate limited: next slot in {wait:.1f}s")
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    Async token bucket; acquire() waits in FIFO order until a token is free.
+    With max_wait set, a caller whose turn is further away than that is
+    rejected up front with RateLimitExceeded rather than queued.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_wait: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.rejected = 0
+
+    def expected_wait(self) -> float:
+        """Seconds until a caller joining the queue now would get a token"""
+        tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+        return max(0.0, (self.waiting + 1 - tokens) / self.rate)
+
+    async def acquire(self):
+        if self.max_wait is not None:
+            wait = self.expected_wait()
+            if wait > self.max_wait:
+                self.rejected += 1
+                raise RateLimitExceeded(wait)
+        self.waiting += 1
+        try:
+            async with self.lock:
+                while True:
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
@@ -0,0 +1,327 @@
+"""
+Historical ETD recorder
+Appends every polled departures snapshot to compact daily column files and
+answers delay percentile queries over a time window.
+
+Layout: <directory>/YYYY-MM-DD/ (UTC days), each file append-only:
+- ts, end: per snapshot, fetch time (uint32 epoch seconds) and total row count after it
+- station, color, destination: per estimate, uint8 codes into the day's schema.json
+- minutes (uint8) and delay (uint16 seconds): per estimate
+A snapshot's rows are appended to every column before its ts/end entry, so rows
+from an interrupted write are ignored by readers and truncated before the next
+append. Appends take an exclusive flock on the day's end file and re-read the
+committed row count from it, so a day written by several processes (e.g. after
+the poller lease moved between workers) stays consistent.
+Each estimate costs 6 bytes on disk and is written exactly once.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+try:
+    import numpy as np
+except ImportError:  # only needed when HISTORY_DIR is set
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked, so run a single recording process
+    fcntl = None
+
+from models import LineColor
+
+# Code for stations, colors or destinations missing from a day's schema
+UNKNOWN = 255
+
+# Delays are aggregated in 1 s bins up to this cap; longer delays count as the cap
+DELAY_CAP_SECONDS = 3600
+
+PERCENTILES = (50, 90, 95, 99)
+
+COLUMNS = {
+    "station": "u1",
+    "color": "u1",
+    "destination": "u1",
+    "minutes": "u1",
+    "delay": "<u2",
+}
+INDEX = {"ts": "<u4", "end": "<u4"}
+
+
+def _day_name(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+class DayLog:
+    """Open append handles for one day's column files"""
+
+    def __init__(self, path: str, schema: dict):
+        self.path = path
+        self.schema = schema
+        self.stations = {abbr: i for i, abbr in enumerate(schema["stations"])}
+        self.colors = {color: i for i, color in enumerate(schema["colors"])}
+        self.files = {name: open(os.path.join(path, name), "ab") for name in (*COLUMNS, *INDEX)}
+        with self._locked():
+            self.rows = self._repair()
+
+    @classmethod
+    def open(cls, path: str, stations: Iterable[str]) -> "DayLog":
+        """Open a day directory, creating it with a fresh schema if needed"""
+        schema_path = os.path.join(path, "schema.json")
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                return cls(path, json.load(f))
+        os.makedirs(path, exist_ok=True)
+        schema = {"version": 1, "stations": list(stations)[:UNKNOWN], "colors": [c.value for c in LineColor]}
+        tmp = schema_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(schema, f)
+        os.replace(tmp, schema_path)
+        return cls(path, schema)
+
+    def _size(self, name: str) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.path, name))
+        except OSError:
+            return 0
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive across processes appending to this day"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self.files["end"].fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.files["end"].fileno(), fcntl.LOCK_UN)
+
+    def _repair(self) -> int:
+        """Drop any partially written snapshot; returns the committed row count. Call locked."""
+        snapshots = min(self._size(name) // np.dtype(dtype).itemsize for name, dtype in INDEX.items())
+        rows = 0
+        if snapshots:
+            itemsize = np.dtype(INDEX["end"]).itemsize
+            end = np.fromfile(os.path.join(self.path, "end"), dtype=INDEX["end"], count=1,
+                              offset=(snapshots - 1) * itemsize)
+            rows = int(end[0])
+        for names, count in ((INDEX, snapshots), (COLUMNS, rows)):
+            for name, dtype in names.items():
+                size = count * np.dtype(dtype).itemsize
+                if self._size(name) > size:
+                    with open(os.path.join(self.path, name), "r+b") as f:
+                        f.truncate(size)
+        return rows
+
+    def append(self, fetched_at: float, columns: Dict[str, "np.ndarray"]):
+        count = len(columns["station"])
+        with self._locked():
+            # Another process may have appended (or left a partial write) since our last append
+            self.rows = self._repair()
+            for name, dtype in COLUMNS.items():
+                self.files[name].write(columns[name].astype(dtype, copy=False).tobytes())
+                self.files[name].flush()
+            self.rows += count
+            # The index entry commits the rows above
+            self.files["ts"].write(np.array([int(fetched_at)], dtype=INDEX["ts"]).tobytes())
+            self.files["end"].write(np.array([self.rows], dtype=INDEX["end"]).tobytes())
+            self.files["ts"].flush()
+            self.files["end"].flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class HistoryRecorder:
+    """Records ETD snapshots to daily column files and aggregates delays from them"""
+
+    def __init__(self, directory: str, stations: Iterable[str], terminal: Callable[[str], Optional[str]],
+                 retention_days: int = 90):
+        """
+        stations: abbreviations coded into each new day's schema
+        terminal: ETD destination name -> station abbreviation (e.g. TripPlanner.terminal)
+        """
+        if np is None:
+            raise RuntimeError("HISTORY_DIR requires numpy")
+        self.directory = directory
+        self.stations = list(stations)
+        self.terminal = terminal
+        self.retention_days = retention_days
+        self.day = None
+        self.day_name = None
+        self.last_error = None
+        self.counters = {"snapshots": 0, "rows": 0, "failures": 0}
+        # record() runs in an executor thread; close() may be called while one is in flight
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_day(self, fetched_at: float) -> DayLog:
+        name = _day_name(fetched_at)
+        if name != self.day_name:
+            if self.day is not None:
+                self.day.close()
+            self.day = DayLog.open(os.path.join(self.directory, name), self.stations)
+            self.day_name = name
+            self._expire(fetched_at)
+        return self.day
+
+    def _expire(self, now: float):
+        """Delete day directories older than retention_days"""
+        cutoff = _day_name(now - self.retention_days * 86400)
+        for name in self.days():
+            if name < cutoff:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def days(self) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name for name in names if len(name) == 10 and name[4] == "-" and name[7] == "-")
+
+    def record(self, snapshot: dict, fetched_at: Optional[float] = None):
+        """
+        Append one orig=ALL snapshot (abbr -> departures payload). Blocks on disk,
+        so call it from an executor. Errors of any kind (disk, a damaged
+        schema.json, ...) are counted, not raised: recording never fails a poll.
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with self.lock:
+            self._record(snapshot, fetched_at)
+
+    def _record(self, snapshot: dict, fetched_at: float):
+        try:
+            day = self._open_day(fetched_at)
+            stations, colors, destinations, minutes, delays = [], [], [], [], []
+            for abbr, payload in snapshot.items():
+                station = day.stations.get(abbr, UNKNOWN)
+                for departure in payload.get("departures", ()):
+                    stations.append(station)
+                    colors.append(day.colors.get(departure.color, UNKNOWN))
+                    destinations.append(day.stations.get(self.terminal(departure.destination), UNKNOWN))
+                    minutes.append(departure.minutes)
+                    delays.append(departure.delay)
+            day.append(fetched_at, {
+                "station": np.array(stations, dtype=np.uint8),
+                "color": np.array(colors, dtype=np.uint8),
+                "destination": np.array(destinations, dtype=np.uint8),
+                "minutes": np.minimum(np.array(minutes, dtype=np.int64), 255),
+                "delay": np.clip(np.array(delays, dtype=np.int64), 0, 65535),
+            })
+        except Exception as e:
+            self.counters["failures"] += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            return
+        self.counters["snapshots"] += 1
+        self.counters["rows"] += len(stations)
+
+    def _histograms(self, name: str, since: float, until: float, station: Optional[str]) -> dict:
+        """(abbr, color) -> delay histogram for one day's snapshots in [since, until]"""
+        path = os.path.join(self.directory, name)
+        try:
+            with open(os.path.join(path, "schema.json")) as f:
+                schema = json.load(f)
+            ts = np.fromfile(os.path.join(path, "ts"), dtype=INDEX["ts"])
+            end = np.fromfile(os.path.join(path, "end"), dtype=INDEX["end"])
+        except (OSError, ValueError):
+            return {}
+        snapshots = min(len(ts), len(end))
+        lo = int(np.searchsorted(ts[:snapshots], since, "left"))
+        hi = int(np.searchsorted(ts[:snapshots], until, "right"))
+        first = int(end[lo - 1]) if lo > 0 else 0
+        last = int(end[hi - 1]) if hi > 0 else 0
+        if last <= first:
+            return {}
+
+        def column(col: str):
+            return np.memmap(os.path.join(path, col), dtype=COLUMNS[col], mode="r")[first:last]
+
+        stations, colors = column("station"), column("color")
+        delays = np.minimum(column("delay"), DELAY_CAP_SECONDS)
+        if station is not None:
+            if station not in schema["stations"]:
+                return {}
+            keep = stations == schema["stations"].index(station)
+            stations, colors, delays = stations[keep], colors[keep], delays[keep]
+
+        # One bincount over (station, color, delay) gives every group's histogram at once
+        ncolors = len(schema["colors"]) + 1
+        bins = DELAY_CAP_SECONDS + 1
+        groups = np.where(colors == UNKNOWN, ncolors - 1, colors).astype(np.int64)
+        groups += np.minimum(stations, len(schema["stations"])).astype(np.int64) * ncolors
+        counts = np.bincount(groups * bins + delays, minlength=(len(schema["stations"]) + 1) * ncolors * bins)
+        counts = counts.reshape(-1, bins)
+
+        names = schema["stations"] + ["unknown"]
+        color_names = schema["colors"] + ["unknown"]
+        return {
+            (names[g // ncolors], color_names[g % ncolors]): counts[g].copy()
+            for g in np.flatnonzero(counts.any(axis=1))
+        }
+
+    def delay_stats(self, since: float, until: float, station: Optional[str] = None) -> list:
+        """Per-station delay percentiles (overall and per line color) for snapshots in [since, until]"""
+        totals = {}
+        first_day, last_day = _day_name(since), _day_name(until)
+        for name in self.days():
+            if first_day <= name <= last_day:
+                for key, counts in self._histograms(name, since, until, station).items():
+                    totals[key] = totals[key] + counts if key in totals else counts
+
+        by_station = {}
+        for (abbr, color), counts in totals.items():
+            by_station.setdefault(abbr, {})[color] = counts
+        return [
+            {
+                "station": abbr,
+                **summarize(sum(lines.values())),
+                "lines": {color: summarize(counts) for color, counts in sorted(lines.items())},
+            }
+            for abbr, lines in sorted(by_station.items())
+        ]
+
+    def close(self):
+        with self.lock:
+            if self.day is not None:
+                self.day.close()
+                self.day = None
+                self.day_name = None
+
+    def stats(self) -> dict:
+        days = self.days()
+        size = 0
+        for name in days:
+            path = os.path.join(self.directory, name)
+            size += sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        return {
+            "directory": self.directory,
+            "days": len(days),
+            "first_day": days[0] if days else None,
+            "bytes": size,
+            "retention_days": self.retention_days,
+            "last_error": self.last_error,
+            **self.counters,
+        }
+
+
+def summarize(counts: "np.ndarray") -> dict:
+    """Sample count, delayed share and delay percentiles from a 1 s-bin histogram"""
+    samples = int(counts.sum())
+    cumulative = np.cumsum(counts)
+    return {
+        "samples": samples,
+        "delayed_share": round(1 - int(counts[0]) / samples, 4),
+        "delay_seconds": {
+            "mean": round(float(np.dot(counts, np.arange(len(counts)))) / samples, 1),
+            **{f"p{p}": int(np.searchsorted(cumulative, samples * p / 100)) for p in PERCENTILES},
+            "max": int(np.flatnonzero(counts)[-1]),
+        },
+    }
@@ -0,0 +1,114 @@
+"""
+HTTP caching headers and conditional requests
+ASGI middleware that tags successful GET responses with an ETag and a
+per-route Cache-Control policy, and answers a matching If-None-Match with 304
+"""
+
+from typing import Dict, Optional
+
+from metrics import REGISTRY
+from serialize import make_etag
+
+NOT_MODIFIED = REGISTRY.counter("http_not_modified_total", "GET requests answered with 304 Not Modified", ("route",))
+
+
+NO_STORE = "no-store"
+
+
+def cache_control(max_age: float, stale_while_revalidate: float = 0) -> str:
+    """Cache-Control value for shared data; max_age 0 means always revalidate"""
+    if max_age <= 0:
+        return "no-cache"
+    value = f"public, max-age={int(max_age)}"
+    if stale_while_revalidate > 0:
+        value += f", stale-while-revalidate={int(stale_while_revalidate)}"
+    return value
+
+
+def _opaque(tag: str) -> str:
+    """Tag without the weak prefix, for weak comparison"""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    target = _opaque(etag)
+    return any(_opaque(candidate) == target for candidate in if_none_match.split(","))
+
+
+class ConditionalMiddleware:
+    """
+    policies maps route templates (e.g. "/api/departures/{station_abbr}") to
+    Cache-Control values; unlisted routes get default. A route can set its own
+    ETag or Cache-Control header (e.g. a precomputed ETag, or no-cache for
+    fallback data); otherwise the ETag is hashed from the response body.
+    Non-GET requests, non-200 responses and event streams pass through untouched.
+    """
+
+    def __init__(self, app, policies: Dict[str, str], default: str = "no-cache"):
+        self.app = app
+        self.policies = policies
+        self.default = default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = None
+        for name, value in scope.get("headers", ()):
+            if name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+
+        start = None
+        chunks = []
+
+        async def send_tagged(message):
+            nonlocal start
+            if start is None and message["type"] == "http.response.start":
+                headers = message.get("headers", ())
+                streaming = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                                for name, value in headers)
+                if message["status"] != 200 or streaming:
+                    start = False
+                    await send(message)
+                    return
+                start = message
+                return
+            if not start or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            # Buffer the (small, JSON) body so it can be hashed before anything is sent
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            await self._finish(scope, start, b"".join(chunks), if_none_match, send)
+
+        await self.app(scope, receive, send_tagged)
+
+    def _policy(self, scope) -> str:
+        return self.policies.get(getattr(scope.get("route"), "path", None), self.default)
+
+    async def _finish(self, scope, start: dict, body: bytes, if_none_match: Optional[str], send):
+        headers = list(start.get("headers", ()))
+        names = {name for name, _ in headers}
+        etag = next((value.decode("latin-1") for name, value in headers if name == b"etag"), None)
+        if etag is None:
+            etag = make_etag(body)
+            headers.append((b"etag", etag.encode("latin-1")))
+        if b"cache-control" not in names:
+            headers.append((b"cache-control", self._policy(scope).encode("latin-1")))
+
+        if if_none_match and etag_matches(if_none_match, etag):
+            NOT_MODIFIED.inc(route=getattr(scope.get("route"), "path", "unmatched"))
+            kept = [(name, value) for name, value in headers
+                    if name not in (b"content-length", b"content-type")]
+            await send({"type": "http.response.start", "status": 304, "headers": kept})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
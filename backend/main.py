@@ -4,11 +4,35 @@ FastAPI backend integrating BART API, Open Meteo, and OpenStreetMap Nominatim
 """
 
 from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
+import functools
 import httpx
+import math
 import os
-from typing import Optional
+import time
+from typing import List, Optional
+
+from cache import ResponseCache
+import metrics
+from models import Departure, Station, group_departures
+from network import TripPlanner
+from metrics import RESPONSE_SOURCE, MetricsMiddleware, stage_timer, timed
+from httpcache import NO_STORE, ConditionalMiddleware, cache_control
+from compression import CompressionMiddleware
+from history import HistoryRecorder
+from geocode import SF_LANDMARKS, GeocodeCache, LocalPlaceIndex, RateLimitExceeded, TokenBucket, normalize_query
+from poller import SnapshotPoller
+from shared import create_store
+from serialize import EncodedBody, EncodedCache, FastJSONResponse, encode, encode_with_items
+from stations import StationRegistry
+from stream import StreamHub, diff_departures, sse_events
+from warmup import WarmUp
+from upstream import SingleFlight, UpstreamPool
 
 # Load environment variables
 load_dotenv()
@@ -18,10 +42,10 @@ load_dotenv()
 BART_API_KEY = os.getenv("BART_API_KEY", "MW9S-E7SL-26DU-VV8V")
 
 # API Base URLs
-BART_BASE_URL = "http://api.bart.gov/api"
-OPEN_METEO_BASE_URL = "https://api.open-meteo.com/v1"
-OPEN_METEO_AQI_URL = "https://air-quality-api.open-meteo.com/v1"
-NOMINATIM_BASE_URL = "https://nominatim.openstreetmap.org"
+BART_BASE_URL = os.getenv("BART_BASE_URL", "http://api.bart.gov/api")
+OPEN_METEO_BASE_URL = os.getenv("OPEN_METEO_BASE_URL", "https://api.open-meteo.com/v1")
+OPEN_METEO_AQI_URL = os.getenv("OPEN_METEO_AQI_URL", "https://air-quality-api.open-meteo.com/v1")
+NOMINATIM_BASE_URL = os.getenv("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org")
 
 # San Francisco coordinates
 SF_LAT = 37.7749
@@ -35,7 +59,7 @@ BROWSER_HEADERS = {
 }
 
 # Fallback BART station data (when API is unavailable)
-FALLBACK_STATIONS = [
+FALLBACK_STATIONS = [Station.from_dict(s) for s in [
     {"abbr": "12TH", "name": "12th St. Oakland City Center", "lat": 37.803768, "lon": -122.271450, "city": "Oakland"},
     {"abbr": "16TH", "name": "16th St. Mission", "lat": 37.765062, "lon": -122.419694, "city": "San Francisco"},
     {"abbr": "19TH", "name": "19th St. Oakland", "lat": 37.808350, "lon": -122.268602, "city": "Oakland"},
@@ -85,10 +109,10 @@ FALLBACK_STATIONS = [
     {"abbr": "WCRK", "name": "Walnut Creek", "lat": 37.905522, "lon": -122.067527, "city": "Walnut Creek"},
     {"abbr": "WDUB", "name": "West Dublin/Pleasanton", "lat": 37.699756, "lon": -121.928240, "city": "Dublin"},
     {"abbr": "WOAK", "name": "West Oakland", "lat": 37.804674, "lon": -122.294582, "city": "Oakland"},
-]
+]]
 
 # Sample departures for demo when API is unavailable
-SAMPLE_DEPARTURES = {
+SAMPLE_DEPARTURES = {abbr: tuple(Departure.from_bart(d["destination"], d) for d in rows) for abbr, rows in {
     "EMBR": [
         {"destination": "Richmond", "minutes": "3", "platform": "2", "direction": "North", "length": "10", "color": "RED", "hexcolor": "#ff0000", "delay": "0"},
         {"destination": "Millbrae", "minutes": "6", "platform": "1", "direction": "South", "length": "10", "color": "RED", "hexcolor": "#ff0000", "delay": "0"},
@@ -102,7 +126,7 @@ SAMPLE_DEPARTURES = {
         {"destination": "Millbrae", "minutes": "10", "platform": "1", "direction": "South", "length": "10", "color": "RED", "hexcolor": "#ff0000", "delay": "0"},
         {"destination": "Dublin/Pleasanton", "minutes": "14", "platform": "2", "direction": "East", "length": "8", "color": "BLUE", "hexcolor": "#0099cc", "delay": "0"},
     ],
-}
+}.items()}
 
 # Weather code to description mapping (Open Meteo WMO codes)
 WEATHER_CODES = {
@@ -137,6 +161,35 @@ AQI_LEVELS = {
     (301, 500): {"level": "Hazardous", "color": "#7e0023", "icon": "⬛"},
 }
 
+# Station lookups by abbreviation and location; rebuilt from live data when available
+station_registry = StationRegistry(FALLBACK_STATIONS)
+
+# BART line graph with every station-to-station route precomputed for /api/trip
+trip_planner = TripPlanner(names={s.abbr: s.name for s in FALLBACK_STATIONS})
+TRIP_MAX_ITINERARIES = int(os.getenv("TRIP_MAX_ITINERARIES", "10"))
+
+# Local place index for /api/search: station names plus common SF landmarks
+place_index = LocalPlaceIndex(
+    [{"name": s.name, "lat": s.lat, "lon": s.lon, "type": "bart_station", "abbr": s.abbr} for s in FALLBACK_STATIONS]
+    + [{"name": name, "lat": lat, "lon": lon, "type": kind} for name, lat, lon, kind in SF_LANDMARKS]
+)
+
+# Persistent Nominatim result cache and rate limit (Nominatim policy: max 1 req/s)
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "geocode_cache.sqlite3"))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "10000"))
+NOMINATIM_RATE = float(os.getenv("NOMINATIM_RATE", "1"))
+# Searches that would queue longer than this for a Nominatim slot get a 503 instead
+NOMINATIM_MAX_WAIT = float(os.getenv("NOMINATIM_MAX_WAIT", "10"))
+
+geocode_cache = GeocodeCache(GEOCODE_CACHE_PATH, ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES)
+nominatim_limiter = TokenBucket(rate=NOMINATIM_RATE, burst=1, max_wait=NOMINATIM_MAX_WAIT)
+# Lookups nobody is waiting for any more give their Nominatim slot back
+geocode_flights = SingleFlight(cancel_orphans=True)
+
+# Bulk nearest-station lookups: maximum points per request
+NEAREST_MAX_POINTS = int(os.getenv("NEAREST_MAX_POINTS", "1000"))
+
 def get_aqi_level(aqi: int) -> dict:
     """Get AQI level description based on US EPA standard"""
     for (low, high), info in AQI_LEVELS.items():
@@ -144,13 +197,141 @@ def get_aqi_level(aqi: int) -> dict:
             return info
     return {"level": "Unknown", "color": "#808080", "icon": "❓"}
 
+# Response cache TTLs in seconds; after expiry a value is served stale for
+# *_STALE_TTL more seconds while a single background refresh runs
+STATIONS_TTL = float(os.getenv("STATIONS_TTL", "21600"))
+STATIONS_STALE_TTL = float(os.getenv("STATIONS_STALE_TTL", "86400"))
+WEATHER_TTL = float(os.getenv("WEATHER_TTL", "600"))
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "1800"))
+AQI_TTL = float(os.getenv("AQI_TTL", "600"))
+AQI_STALE_TTL = float(os.getenv("AQI_STALE_TTL", "1800"))
+ETD_TTL = float(os.getenv("ETD_TTL", "20"))
+ETD_STALE_TTL = float(os.getenv("ETD_STALE_TTL", "20"))
+
+# Weather/AQI grid cell size in degrees (~2 km) and station-area batch prefetch
+# interval in seconds (0 disables prefetch; cells are then fetched on demand)
+WEATHER_GRID_DEGREES = float(os.getenv("WEATHER_GRID_DEGREES", "0.02"))
+CONDITIONS_PREFETCH_INTERVAL = float(os.getenv("CONDITIONS_PREFETCH_INTERVAL", "540"))
+
+# Background orig=ALL ETD polling interval in seconds (0 disables the poller and
+# departures are fetched per station on demand); snapshots older than
+# ETD_SNAPSHOT_MAX_AGE are not served
+ETD_POLL_INTERVAL = float(os.getenv("ETD_POLL_INTERVAL", "30"))
+ETD_SNAPSHOT_MAX_AGE = float(os.getenv("ETD_SNAPSHOT_MAX_AGE", "300"))
+
+# Store shared by worker processes: local (single worker), sqlite (workers on one
+# host) or redis. With a shared store one elected worker polls BART/Open Meteo
+# and the others adopt its snapshots.
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "local")
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_cache.sqlite3"))
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "redis://localhost:6379/0")
+
+# Batch departures: station count limit and upstream fan-out when not served from the snapshot
+BATCH_MAX_STATIONS = int(os.getenv("BATCH_MAX_STATIONS", "60"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# Live update stream: shared reload interval, per-client queue bound and keepalive, in seconds
+STREAM_INTERVAL = float(os.getenv("STREAM_INTERVAL", "5"))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "16"))
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+
+# Browser/CDN Cache-Control max-age per data type, in seconds; after that
+# clients revalidate with If-None-Match and usually get a 304
+HTTP_MAX_AGE_STATIONS = float(os.getenv("HTTP_MAX_AGE_STATIONS", "3600"))
+HTTP_MAX_AGE_DEPARTURES = float(os.getenv("HTTP_MAX_AGE_DEPARTURES", "5"))
+HTTP_MAX_AGE_CONDITIONS = float(os.getenv("HTTP_MAX_AGE_CONDITIONS", "300"))
+HTTP_MAX_AGE_SEARCH = float(os.getenv("HTTP_MAX_AGE_SEARCH", "86400"))
+
+# Optional ETD history: every polled snapshot is appended to daily column files
+# under HISTORY_DIR (empty disables recording) and kept HISTORY_RETENTION_DAYS days
+HISTORY_DIR = os.getenv("HISTORY_DIR", "")
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))
+
+# gzip (or brotli, if installed) for response bodies of at least this many bytes (0 disables)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Startup warm-up: seconds before /api/ready reports ready even if some prefetches
+# are still running (0 reports ready at once while warm-up carries on)
+WARMUP_DEADLINE = float(os.getenv("WARMUP_DEADLINE", "10"))
+
+shared_store = create_store(SHARED_CACHE_BACKEND, SHARED_CACHE_PATH, SHARED_CACHE_URL)
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+)
+
+# Pre-serialized bodies (with ETags) for payloads reused across requests
+encoded_bodies = EncodedCache()
+
+# Shared upstream clients, one connection pool per host
+upstreams = UpstreamPool(headers=BROWSER_HEADERS)
+upstreams.register("bart", BART_BASE_URL, timeout=float(os.getenv("BART_TIMEOUT", "15")))
+upstreams.register("open_meteo", OPEN_METEO_BASE_URL, timeout=float(os.getenv("OPEN_METEO_TIMEOUT", "10")), http2=True)
+upstreams.register("air_quality", OPEN_METEO_AQI_URL, timeout=float(os.getenv("OPEN_METEO_TIMEOUT", "10")), http2=True)
+upstreams.register("nominatim", NOMINATIM_BASE_URL, timeout=float(os.getenv("NOMINATIM_TIMEOUT", "10")), http2=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open upstream connection pools, warm up and start background polling; tear down on shutdown"""
+    await upstreams.start()
+    # Pollers are started by their warm-up steps, right after the first poll
+    warmup.start()
+    stream_hub.start()
+    try:
+        yield
+    finally:
+        await warmup.stop()
+        await stream_hub.stop()
+        await conditions_poller.stop()
+        await etd_poller.stop()
+        await shared_store.close()
+        if etd_history is not None:
+            etd_history.close()
+        await response_cache.close()
+        await upstreams.close()
+        geocode_cache.close()
+
+
 # Initialize FastAPI
 app = FastAPI(
     title="SF Transit & Weather API",
     description="API for BART real-time departures and San Francisco weather using Open Meteo",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
+# ETags, If-None-Match -> 304 and Cache-Control per route (unlisted routes: no-cache)
+CACHE_POLICIES = {
+    "/api/stations": cache_control(HTTP_MAX_AGE_STATIONS, stale_while_revalidate=STATIONS_STALE_TTL),
+    "/api/nearest": cache_control(HTTP_MAX_AGE_STATIONS),
+    "/api/departures/{station_abbr}": cache_control(HTTP_MAX_AGE_DEPARTURES),
+    "/api/departures": cache_control(HTTP_MAX_AGE_DEPARTURES),
+    "/api/trip": cache_control(HTTP_MAX_AGE_DEPARTURES),
+    "/api/weather": cache_control(HTTP_MAX_AGE_CONDITIONS),
+    "/api/aqi": cache_control(HTTP_MAX_AGE_CONDITIONS),
+    "/api/conditions": cache_control(HTTP_MAX_AGE_CONDITIONS),
+    "/api/search": cache_control(HTTP_MAX_AGE_SEARCH),
+    "/metrics": NO_STORE,
+    "/api/health/upstreams": NO_STORE,
+    "/api/cache/stats": NO_STORE,
+    "/api/poller/status": NO_STORE,
+    "/api/stream/status": NO_STORE,
+    "/api/search/stats": NO_STORE,
+    "/api/history/status": NO_STORE,
+    "/api/ready": NO_STORE,
+}
+# Inside the ETag middleware, so 304s carry the compressed response's ETag and Vary
+if COMPRESSION_MIN_SIZE > 0:
+    app.add_middleware(CompressionMiddleware, min_size=COMPRESSION_MIN_SIZE)
+
+app.add_middleware(ConditionalMiddleware, policies=CACHE_POLICIES)
+
+# Per-route request counts, latency and in-flight gauge for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # CORS middleware for React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -160,64 +341,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# HTTP client with timeout and browser headers
-async def get_client():
-    return httpx.AsyncClient(timeout=15.0, headers=BROWSER_HEADERS)
-
-
 # ==================== HELPER FUNCTIONS ====================
 
+@timed("normalize_bart_stations")
 def normalize_bart_stations(data: dict) -> list:
-    """Normalize BART station data to consistent format"""
+    """Normalize BART station data to Station records"""
     try:
         stations = data.get("root", {}).get("stations", {}).get("station", [])
-        return [
-            {
-                "abbr": s.get("abbr"),
-                "name": s.get("name"),
-                "lat": float(s.get("gtfs_latitude", 0)),
-                "lon": float(s.get("gtfs_longitude", 0)),
-                "address": s.get("address"),
-                "city": s.get("city"),
-                "zipcode": s.get("zipcode")
-            }
-            for s in stations
-        ]
+        return [Station.from_bart(s) for s in stations]
     except Exception:
         return []
 
 
+def normalize_bart_station_etd(station: dict) -> dict:
+    """Normalize the ETD block of a single station from a BART etd response"""
+    departures = tuple(
+        Departure.from_bart(etd.get("destination"), est)
+        for etd in station.get("etd", [])
+        for est in etd.get("estimate", [])
+    )
+    
+    return {
+        "station_name": station.get("name"),
+        "station_abbr": station.get("abbr"),
+        "departures": departures
+    }
+
+
+@timed("normalize_bart_departures")
 def normalize_bart_departures(data: dict) -> dict:
     """Normalize BART departure data"""
     try:
         root = data.get("root", {})
         station = root.get("station", [{}])[0]
-        etd_list = station.get("etd", [])
-        
-        departures = []
-        for etd in etd_list:
-            destination = etd.get("destination")
-            for est in etd.get("estimate", []):
-                departures.append({
-                    "destination": destination,
-                    "minutes": est.get("minutes"),
-                    "platform": est.get("platform"),
-                    "direction": est.get("direction"),
-                    "length": est.get("length"),
-                    "color": est.get("color"),
-                    "hexcolor": est.get("hexcolor"),
-                    "delay": est.get("delay")
-                })
-        
+        return normalize_bart_station_etd(station)
+    except Exception:
+        return {"station_name": "", "station_abbr": "", "departures": []}
+
+
+@timed("normalize_bart_departures_all")
+def normalize_bart_departures_all(data: dict) -> dict:
+    """Normalize a multi-station (orig=ALL) BART departure response, keyed by abbr"""
+    try:
+        stations = data.get("root", {}).get("station", [])
         return {
-            "station_name": station.get("name"),
-            "station_abbr": station.get("abbr"),
-            "departures": departures
+            s.get("abbr"): normalize_bart_station_etd(s)
+            for s in stations
+            if s.get("abbr")
         }
     except Exception:
-        return {"station_name": "", "station_abbr": "", "departures": []}
+        return {}
 
 
+@timed("normalize_open_meteo_weather")
 def normalize_open_meteo_weather(data: dict) -> dict:
     """Normalize Open Meteo weather data with user's exact format"""
     try:
@@ -258,6 +434,491 @@ def normalize_open_meteo_weather(data: dict) -> dict:
         return {}
 
 
+@timed("normalize_open_meteo_aqi")
+def normalize_open_meteo_aqi(data: dict) -> dict:
+    """Normalize Open Meteo air quality data"""
+    current = data.get("current", {})
+    aqi_value = current.get("us_aqi", 0)
+    aqi_info = get_aqi_level(aqi_value)
+    
+    return {
+        "city": "San Francisco",
+        "aqi": aqi_value,
+        "aqi_level": aqi_info["level"],
+        "aqi_color": aqi_info["color"],
+        "aqi_icon": aqi_info["icon"],
+        "pollutants": {
+            "pm2_5": current.get("pm2_5", 0),
+            "pm10": current.get("pm10", 0),
+            "ozone": current.get("ozone", 0),
+            "nitrogen_dioxide": current.get("nitrogen_dioxide", 0),
+            "carbon_monoxide": current.get("carbon_monoxide", 0)
+        }
+    }
+
+
+def snap_to_grid(lat: float, lon: float) -> tuple:
+    """Snap a coordinate to the centre of its weather grid cell so nearby requests share a cache entry"""
+    return (
+        round(round(lat / WEATHER_GRID_DEGREES) * WEATHER_GRID_DEGREES, 4),
+        round(round(lon / WEATHER_GRID_DEGREES) * WEATHER_GRID_DEGREES, 4)
+    )
+
+
+def conditions_cache_key(kind: str, cell: tuple) -> str:
+    return f"{kind}:{cell[0]}:{cell[1]}"
+
+
+def resolve_location(lat: Optional[float], lon: Optional[float], station: Optional[str]) -> tuple:
+    """
+    Resolve weather/AQI query parameters to (lat, lon, city label).
+    Accepts a station abbreviation or a lat/lon pair; defaults to San Francisco.
+    """
+    if station:
+        found = station_registry.get(station.upper())
+        if found is None:
+            raise HTTPException(status_code=400, detail=f"Invalid station abbreviation: {station}")
+        return found.lat, found.lon, found.city or found.name
+    if lat is None and lon is None:
+        return SF_LAT, SF_LON, "San Francisco"
+    if lat is None or lon is None:
+        raise HTTPException(status_code=400, detail="Both lat and lon are required")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat/lon out of range")
+    
+    # Label with the nearest station's city when the point is near the BART network
+    nearest = station_registry.nearest(lat, lon, 1)
+    if nearest and nearest[0][0] <= 10:
+        return lat, lon, nearest[0][1].city
+    return lat, lon, f"{lat:.2f}, {lon:.2f}"
+
+
+def parse_fields(fields: Optional[str], record: type) -> Optional[tuple]:
+    """?fields= value to field names in record order; None keeps every field"""
+    if not fields:
+        return None
+    try:
+        return record.select(fields.split(",")) or None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def decode_json(response: httpx.Response):
+    """Parse an upstream JSON body, timed as its own stage"""
+    with stage_timer("json_decode"):
+        return response.json()
+
+
+# ==================== UPSTREAM FETCHERS ====================
+# Each fetcher returns normalized data or raises; endpoints cache the result
+# and decide how to fall back.
+
+async def fetch_bart_stations() -> list:
+    """Fetch and normalize the BART station list"""
+    response = await upstreams.fetch(
+        "bart", f"{BART_BASE_URL}/stn.aspx",
+        params={
+            "cmd": "stns",
+            "key": BART_API_KEY,
+            "json": "y"
+        }
+    )
+    response.raise_for_status()
+    
+    # Check if response is HTML (Cloudflare challenge)
+    content_type = response.headers.get("content-type", "")
+    if "text/html" in content_type:
+        raise Exception("Cloudflare challenge detected")
+    
+    stations = normalize_bart_stations(decode_json(response))
+    if not stations:
+        raise Exception("Empty response from BART API")
+    station_registry.load(stations)
+    return stations
+
+
+async def fetch_bart_departures(station_abbr: str) -> dict:
+    """Fetch and normalize real-time departures for one station"""
+    response = await upstreams.fetch(
+        "bart", f"{BART_BASE_URL}/etd.aspx",
+        params={
+            "cmd": "etd",
+            "orig": station_abbr,
+            "key": BART_API_KEY,
+            "json": "y"
+        }
+    )
+    response.raise_for_status()
+    
+    # Check if response is HTML (Cloudflare challenge)
+    content_type = response.headers.get("content-type", "")
+    if "text/html" in content_type:
+        raise Exception("Cloudflare challenge detected")
+    
+    data = decode_json(response)
+    
+    # Check for API error
+    if "error" in data.get("root", {}):
+        error_msg = data["root"]["error"].get("message", "Unknown error")
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    return normalize_bart_departures(data)
+
+
+async def fetch_bart_departures_all() -> dict:
+    """Fetch and normalize real-time departures for every station (orig=ALL)"""
+    response = await upstreams.fetch(
+        "bart", f"{BART_BASE_URL}/etd.aspx",
+        params={
+            "cmd": "etd",
+            "orig": "ALL",
+            "key": BART_API_KEY,
+            "json": "y"
+        }
+    )
+    response.raise_for_status()
+    
+    # Check if response is HTML (Cloudflare challenge)
+    content_type = response.headers.get("content-type", "")
+    if "text/html" in content_type:
+        raise Exception("Cloudflare challenge detected")
+    
+    departures = normalize_bart_departures_all(decode_json(response))
+    if not departures:
+        raise Exception("Empty response from BART API")
+    return departures
+
+
+def decode_etd_snapshot(data: dict) -> dict:
+    """Rebuild Departure records in an ETD snapshot adopted from the shared store"""
+    return {
+        abbr: {**entry, "departures": tuple(Departure.from_bart(d["destination"], d) for d in entry["departures"])}
+        for abbr, entry in data.items()
+    }
+
+
+# System-wide ETD snapshot, refreshed in the background
+etd_history = HistoryRecorder(
+    HISTORY_DIR, stations=sorted(set(station_registry.abbrs()) | set(trip_planner.at_station)),
+    terminal=trip_planner.terminal, retention_days=HISTORY_RETENTION_DAYS
+) if HISTORY_DIR else None
+
+
+async def poll_bart_departures_all() -> dict:
+    """Poller fetch: system-wide departures, recorded to history when enabled"""
+    departures = await fetch_bart_departures_all()
+    # Only the lease holder records: when the shared store is down every worker polls.
+    # File I/O (locking, repair, day rollover) stays off the event loop; record() never raises.
+    if etd_history is not None and etd_poller.authoritative:
+        await asyncio.get_running_loop().run_in_executor(None, etd_history.record, departures, time.time())
+    return departures
+
+
+etd_poller = SnapshotPoller(
+    poll_bart_departures_all, interval=ETD_POLL_INTERVAL,
+    name="etd", store=shared_store, decode=decode_etd_snapshot
+)
+
+
+async def fetch_geocode(q: str) -> list:
+    """Geocode a free-text query with Nominatim, waiting for a rate limiter token"""
+    await nominatim_limiter.acquire()
+    response = await upstreams.fetch(
+        "nominatim", f"{NOMINATIM_BASE_URL}/search",
+        params={
+            "q": f"{q}, San Francisco, CA",
+            "format": "json",
+            "limit": 5,
+            "addressdetails": 1
+        },
+        headers={
+            "User-Agent": "SFTransitWeatherApp/1.0 (transit-demo)"
+        }
+    )
+    response.raise_for_status()
+    
+    # Normalize results
+    return [
+        {
+            "name": r.get("display_name"),
+            "lat": float(r.get("lat", 0)),
+            "lon": float(r.get("lon", 0)),
+            "type": r.get("type"),
+            "importance": r.get("importance")
+        }
+        for r in decode_json(response)
+    ]
+
+
+def open_meteo_results(data) -> list:
+    """Open Meteo returns an object for one coordinate and a list for several"""
+    return data if isinstance(data, list) else [data]
+
+
+async def fetch_weather_cells(cells: list) -> list:
+    """Fetch and normalize current weather for many (lat, lon) points in one request"""
+    response = await upstreams.fetch(
+        "open_meteo", f"{OPEN_METEO_BASE_URL}/forecast",
+        params={
+            "latitude": ",".join(str(lat) for lat, _ in cells),
+            "longitude": ",".join(str(lon) for _, lon in cells),
+            "current_weather": "true",
+            "hourly": "precipitation,rain",
+            "timezone": "America/Los_Angeles"
+        }
+    )
+    response.raise_for_status()
+    return [normalize_open_meteo_weather(d) for d in open_meteo_results(decode_json(response))]
+
+
+async def fetch_aqi_cells(cells: list) -> list:
+    """Fetch and normalize current air quality for many (lat, lon) points in one request"""
+    response = await upstreams.fetch(
+        "air_quality", f"{OPEN_METEO_AQI_URL}/air-quality",
+        params={
+            "latitude": ",".join(str(lat) for lat, _ in cells),
+            "longitude": ",".join(str(lon) for _, lon in cells),
+            "current": "us_aqi,pm10,pm2_5,carbon_monoxide,nitrogen_dioxide,ozone",
+            "timezone": "America/Los_Angeles"
+        }
+    )
+    response.raise_for_status()
+    return [normalize_open_meteo_aqi(d) for d in open_meteo_results(decode_json(response))]
+
+
+async def fetch_weather(lat: float = SF_LAT, lon: float = SF_LON) -> dict:
+    """Fetch and normalize current weather for one point (San Francisco by default)"""
+    return (await fetch_weather_cells([(lat, lon)]))[0]
+
+
+async def fetch_aqi(lat: float = SF_LAT, lon: float = SF_LON) -> dict:
+    """Fetch and normalize current air quality for one point (San Francisco by default)"""
+    return (await fetch_aqi_cells([(lat, lon)]))[0]
+
+
+async def prefetch_station_conditions() -> dict:
+    """
+    Warm the weather/AQI cache for every station-area grid cell with one
+    batched Open Meteo request per API
+    """
+    cells = sorted({snap_to_grid(s.lat, s.lon) for s in station_registry.stations} | {snap_to_grid(SF_LAT, SF_LON)})
+    weather, aqi = await asyncio.gather(fetch_weather_cells(cells), fetch_aqi_cells(cells), return_exceptions=True)
+    if isinstance(weather, Exception) and isinstance(aqi, Exception):
+        raise weather
+    
+    return {
+        "cells": len(cells),
+        "weather": {} if isinstance(weather, Exception) else {
+            conditions_cache_key("weather", cell): value for cell, value in zip(cells, weather)
+        },
+        "aqi": {} if isinstance(aqi, Exception) else {
+            conditions_cache_key("aqi", cell): value for cell, value in zip(cells, aqi)
+        }
+    }
+
+
+def apply_station_conditions(snapshot: dict):
+    """Load a station-area conditions snapshot (fetched or adopted) into the response cache"""
+    for key, value in snapshot["weather"].items():
+        response_cache.set(key, value, WEATHER_TTL, WEATHER_STALE_TTL)
+    for key, value in snapshot["aqi"].items():
+        response_cache.set(key, value, AQI_TTL, AQI_STALE_TTL)
+
+
+# Station-area weather/AQI, refreshed in the background in batched requests
+conditions_poller = SnapshotPoller(
+    prefetch_station_conditions, interval=CONDITIONS_PREFETCH_INTERVAL,
+    name="conditions", store=shared_store, on_update=apply_station_conditions
+)
+
+
+def departures_from_snapshot(station_abbr: str, station_name: str) -> tuple:
+    """
+    Look up one station in the poller's system-wide snapshot.
+    Returns (departures, snapshot_age); raises if there is no usable snapshot.
+    """
+    age = etd_poller.age()
+    if age is None:
+        raise Exception("ETD poller has not completed a successful poll")
+    if age > ETD_SNAPSHOT_MAX_AGE:
+        raise Exception(f"ETD snapshot is {round(age)}s old")
+    
+    departures = etd_poller.get(station_abbr)
+    if departures is None:
+        # orig=ALL omits stations with no trains scheduled right now
+        if station_abbr not in station_registry:
+            raise HTTPException(status_code=400, detail=f"Invalid station abbreviation: {station_abbr}")
+        departures = {"station_name": station_name, "station_abbr": station_abbr, "departures": []}
+    return departures, round(age, 1)
+
+
+async def load_departures(station_abbr: str) -> dict:
+    """
+    Departures response for one station: poller snapshot, then cached
+    per-station fetch, then sample data. Raises HTTPException for unknown stations.
+    """
+    station_abbr = station_abbr.upper()
+    station_name = station_registry.name(station_abbr, station_abbr)
+    
+    try:
+        if etd_poller.enabled:
+            departures, snapshot_age = departures_from_snapshot(station_abbr, station_name)
+            return {
+                "success": True,
+                "source": "live",
+                **departures,
+                "snapshot_age": snapshot_age
+            }
+        
+        departures = await response_cache.get_or_fetch(
+            f"etd:{station_abbr}", lambda: fetch_bart_departures(station_abbr),
+            ttl=ETD_TTL, stale_ttl=ETD_STALE_TTL
+        )
+        return {
+            "success": True,
+            "source": "live",
+            **departures
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Fallback to sample data
+        sample = SAMPLE_DEPARTURES.get(station_abbr, SAMPLE_DEPARTURES.get("EMBR", []))
+        return {
+            "success": True,
+            "station_name": station_name,
+            "station_abbr": station_abbr,
+            "departures": sample,
+            "source": "demo",
+            "note": "Demo data - API temporarily unavailable"
+        }
+
+
+def encode_departures(payload: dict, fields: Optional[tuple] = None, grouped: bool = False) -> EncodedBody:
+    """
+    Encoded load_departures() result. Everything but snapshot_age is encoded
+    once per departures tuple (i.e. once per poll or cache fill) and reused;
+    snapshot_age is appended per request and left out of the ETag.
+    fields projects each departure; grouped uses the by-destination format.
+    """
+    if "departures" not in payload:
+        return encode(payload)
+
+    def build() -> dict:
+        stable = {key: value for key, value in payload.items() if key != "snapshot_age"}
+        if grouped:
+            stable["format"] = "grouped"
+            stable["departures"] = group_departures(payload["departures"], fields)
+        elif fields:
+            stable["departures"] = [departure.to_dict(fields) for departure in payload["departures"]]
+        return stable
+
+    stable = encoded_bodies.get(
+        ("departures", payload["station_abbr"], payload["source"], fields, grouped), payload["departures"], build
+    )
+    if "snapshot_age" in payload:
+        return stable.extend({"snapshot_age": payload["snapshot_age"]})
+    return stable
+
+
+async def load_stream_key(key: str) -> dict:
+    """Current payload for a stream key: departures:<abbr>, weather or aqi"""
+    try:
+        if key.startswith("departures:"):
+            payload = await load_departures(key.split(":", 1)[1])
+            # Drop fields that change every tick so only real changes are pushed
+            payload.pop("snapshot_age", None)
+            return payload
+        if key == "weather":
+            return await get_weather()
+        if key == "aqi":
+            return await get_aqi()
+    except HTTPException as e:
+        return {"success": False, "error": e.detail}
+    raise ValueError(f"Unknown stream key: {key}")
+
+
+# Live update hub shared by every /api/stream client
+stream_hub = StreamHub(load_stream_key, interval=STREAM_INTERVAL, queue_size=STREAM_QUEUE_SIZE,
+                       differs={"departures": diff_departures})
+
+
+async def warm_stations():
+    await response_cache.get_or_fetch("stations", fetch_bart_stations, ttl=STATIONS_TTL, stale_ttl=STATIONS_STALE_TTL)
+
+
+async def warm_weather():
+    """Default (San Francisco) weather cell, when station-area prefetch is off"""
+    cell = snap_to_grid(SF_LAT, SF_LON)
+    await response_cache.get_or_fetch(
+        conditions_cache_key("weather", cell), lambda: fetch_weather(*cell), ttl=WEATHER_TTL, stale_ttl=WEATHER_STALE_TTL
+    )
+
+
+async def warm_aqi():
+    cell = snap_to_grid(SF_LAT, SF_LON)
+    await response_cache.get_or_fetch(
+        conditions_cache_key("aqi", cell), lambda: fetch_aqi(*cell), ttl=AQI_TTL, stale_ttl=AQI_STALE_TTL
+    )
+
+
+def warm_poller(poller: SnapshotPoller):
+    """Warm-up step making a poller's first poll, then starting its background loop"""
+    async def warm():
+        ok = await poller.poll_once()
+        poller.start(delay=poller.next_poll_in)
+        if not ok:
+            raise Exception(poller.last_error or "No snapshot published yet")
+    return warm
+
+
+# Boot-time prefetch of everything the first visitors would otherwise wait for:
+# stations, weather/AQI and system-wide ETDs (which also opens the pooled
+# upstream connections), plus a DNS lookup of every upstream host
+warmup = WarmUp(deadline=WARMUP_DEADLINE)
+warmup.add("stations", warm_stations)
+if conditions_poller.enabled:
+    warmup.add("conditions", warm_poller(conditions_poller))
+else:
+    warmup.add("weather", warm_weather)
+    warmup.add("aqi", warm_aqi)
+if etd_poller.enabled:
+    warmup.add("etd", warm_poller(etd_poller))
+for upstream in upstreams.hosts:
+    warmup.add(f"dns:{upstream}", functools.partial(upstreams.resolve, upstream))
+
+
+# Scrape-time gauges mirroring counters kept by the cache, breaker and poller objects
+CACHE_LOOKUPS = metrics.REGISTRY.counter("cache_lookups_total", "Cache lookups by result", ("cache", "result"))
+CACHE_ENTRIES = metrics.REGISTRY.gauge("cache_entries", "Entries currently cached", ("cache",))
+CIRCUIT_STATE = metrics.REGISTRY.gauge("upstream_circuit_state", "1 for the current circuit breaker state of each upstream", ("upstream", "state"))
+CIRCUIT_REJECTED = metrics.REGISTRY.counter("upstream_circuit_rejected_total", "Calls rejected by an open circuit", ("upstream",))
+COALESCED = metrics.REGISTRY.counter("upstream_coalesced_total", "Upstream fetches by single-flight role", ("role",))
+SNAPSHOT_AGE = metrics.REGISTRY.gauge("snapshot_age_seconds", "Age of the last successful background poll (-1 if never)", ("poller",))
+STREAM_SUBSCRIBERS = metrics.REGISTRY.gauge("stream_subscribers", "Open /api/stream connections")
+
+
+def collect_metrics():
+    for result in ("hits", "misses", "stale"):
+        CACHE_LOOKUPS.set(response_cache.counters[result], cache="response", result=result)
+    for result in ("hits", "misses", "expired"):
+        CACHE_LOOKUPS.set(geocode_cache.counters[result], cache="geocode", result=result)
+    CACHE_ENTRIES.set(len(response_cache.entries), cache="response")
+    for name, breaker in upstreams.breakers.items():
+        for state in ("closed", "open", "half_open"):
+            CIRCUIT_STATE.set(1 if breaker.state == state else 0, upstream=name, state=state)
+        CIRCUIT_REJECTED.set(breaker.counters["rejected"], upstream=name)
+    COALESCED.set(upstreams.flights.counters["leaders"], role="leader")
+    COALESCED.set(upstreams.flights.counters["followers"], role="follower")
+    for name, poller in (("etd", etd_poller), ("conditions", conditions_poller)):
+        age = poller.age()
+        SNAPSHOT_AGE.set(round(age, 3) if age is not None else -1, poller=name)
+    STREAM_SUBSCRIBERS.set(len(stream_hub.subscriptions))
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
+
+
 # ==================== API ENDPOINTS ====================
 
 @app.get("/")
@@ -274,252 +935,545 @@ async def root():
         "endpoints": {
             "stations": "/api/stations",
             "departures": "/api/departures/{station_abbr}",
+            "departures_batch": "/api/departures?stations=EMBR,MONT",
+            "trip": "/api/trip?orig=EMBR&dest=SFIA",
+            "delay_history": "/api/history/delays?station=EMBR&hours=24",
             "weather": "/api/weather",
             "aqi": "/api/aqi",
-            "search": "/api/search?q={query}"
+            "conditions": "/api/conditions",
+            "search": "/api/search?q={query}",
+            "search_stats": "/api/search/stats",
+            "nearest": "/api/nearest?lat={lat}&lon={lon}&k=3",
+            "nearest_bulk": "POST /api/nearest/bulk",
+            "upstream_health": "/api/health/upstreams",
+            "ready": "/api/ready",
+            "metrics": "/metrics",
+            "cache_stats": "/api/cache/stats",
+            "poller_status": "/api/poller/status",
+            "stream": "/api/stream?stations=EMBR&weather=true&aqi=true"
         }
     }
 
 
+def project_stations(stations: list, fields: Optional[tuple]) -> list:
+    return [station.to_dict(fields) for station in stations] if fields else stations
+
+
 @app.get("/api/stations")
-async def get_stations():
+async def get_stations(
+    fields: Optional[str] = Query(None, description="Comma-separated station fields, e.g. abbr,name,lat,lon")
+):
     """
     Get list of all BART stations with coordinates
     Falls back to cached data if API is unavailable
+    
+    - **fields**: only these fields per station (default: all)
     """
-    async with await get_client() as client:
-        try:
-            response = await client.get(
-                f"{BART_BASE_URL}/stn.aspx",
-                params={
-                    "cmd": "stns",
-                    "key": BART_API_KEY,
-                    "json": "y"
-                }
-            )
-            response.raise_for_status()
-            
-            # Check if response is HTML (Cloudflare challenge)
-            content_type = response.headers.get("content-type", "")
-            if "text/html" in content_type:
-                raise Exception("Cloudflare challenge detected")
-            
-            data = response.json()
-            stations = normalize_bart_stations(data)
-            
-            if stations:
-                return {
-                    "success": True,
-                    "count": len(stations),
-                    "stations": stations,
-                    "source": "live"
-                }
-            else:
-                raise Exception("Empty response from BART API")
-                
-        except Exception as e:
-            # Fallback to cached data
-            return {
-                "success": True,
-                "count": len(FALLBACK_STATIONS),
-                "stations": FALLBACK_STATIONS,
-                "source": "cached",
-                "note": "Using cached station data (API temporarily unavailable)"
-            }
+    fields = parse_fields(fields, Station)
+    try:
+        stations = await response_cache.get_or_fetch(
+            "stations", fetch_bart_stations, ttl=STATIONS_TTL, stale_ttl=STATIONS_STALE_TTL
+        )
+        RESPONSE_SOURCE.inc(endpoint="stations", source="live")
+        # Encoded once per cached station list (and field set), not once per request
+        return FastJSONResponse(encoded_bodies.get(("stations", fields), stations, lambda: {
+            "success": True,
+            "count": len(stations),
+            "stations": project_stations(stations, fields),
+            "source": "live"
+        }))
+    except Exception as e:
+        # Fallback to cached data
+        RESPONSE_SOURCE.inc(endpoint="stations", source="cached")
+        return FastJSONResponse(encoded_bodies.get(("stations:fallback", fields), FALLBACK_STATIONS, lambda: {
+            "success": True,
+            "count": len(FALLBACK_STATIONS),
+            "stations": project_stations(FALLBACK_STATIONS, fields),
+            "source": "cached",
+            "note": "Using cached station data (API temporarily unavailable)"
+        }), headers={"Cache-Control": "no-cache"})
+
+
+DEPARTURE_FIELDS = Query(None, description="Comma-separated departure fields, e.g. destination,minutes,color")
+DEPARTURE_FORMAT = Query("full", alias="format", pattern="^(full|grouped)$",
+                         description="grouped: one entry per destination and line with per-train lists")
 
 
 @app.get("/api/departures/{station_abbr}")
-async def get_departures(station_abbr: str):
+async def get_departures(station_abbr: str, fields: Optional[str] = DEPARTURE_FIELDS, view: str = DEPARTURE_FORMAT):
     """
     Get real-time train departures for a specific BART station
     Falls back to sample data if API is unavailable
     
     - **station_abbr**: 4-letter station abbreviation (e.g., EMBR, POWL, 16TH)
+    - **fields**: only these fields per departure (default: all)
+    - **format**: full (default) or grouped
     """
-    station_abbr = station_abbr.upper()
-    station_name = next((s["name"] for s in FALLBACK_STATIONS if s["abbr"] == station_abbr), station_abbr)
-    
-    async with await get_client() as client:
-        try:
-            response = await client.get(
-                f"{BART_BASE_URL}/etd.aspx",
-                params={
-                    "cmd": "etd",
-                    "orig": station_abbr,
-                    "key": BART_API_KEY,
-                    "json": "y"
-                }
-            )
-            response.raise_for_status()
-            
-            # Check if response is HTML (Cloudflare challenge)
-            content_type = response.headers.get("content-type", "")
-            if "text/html" in content_type:
-                raise Exception("Cloudflare challenge detected")
-            
-            data = response.json()
-            
-            # Check for API error
-            if "error" in data.get("root", {}):
-                error_msg = data["root"]["error"].get("message", "Unknown error")
-                raise HTTPException(status_code=400, detail=error_msg)
-            
-            departures = normalize_bart_departures(data)
-            
-            return {
-                "success": True,
-                "source": "live",
-                **departures
-            }
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            # Fallback to sample data
-            sample = SAMPLE_DEPARTURES.get(station_abbr, SAMPLE_DEPARTURES.get("EMBR", []))
-            return {
-                "success": True,
-                "station_name": station_name,
-                "station_abbr": station_abbr,
-                "departures": sample,
-                "source": "demo",
-                "note": "Demo data - API temporarily unavailable"
-            }
+    fields = parse_fields(fields, Departure)
+    departures = await load_departures(station_abbr.upper())
+    RESPONSE_SOURCE.inc(endpoint="departures", source=departures["source"])
+    headers = {"Cache-Control": "no-cache"} if departures["source"] == "demo" else None
+    return FastJSONResponse(encode_departures(departures, fields, view == "grouped"), headers=headers)
+
+
+@app.get("/api/departures")
+async def get_departures_batch(
+    stations: str = Query(..., min_length=3, description="Comma-separated station abbreviations, or ALL"),
+    fields: Optional[str] = DEPARTURE_FIELDS,
+    view: str = DEPARTURE_FORMAT
+):
+    """
+    Get real-time departures for several BART stations in one call
+    Served from the system-wide ETD snapshot when the poller is running,
+    otherwise fetched concurrently with bounded parallelism.
+    Each station carries its own success flag; one bad station never fails the batch.
+    
+    - **stations**: e.g. EMBR,MONT,POWL or ALL
+    - **fields** / **format**: as for a single station
+    """
+    fields = parse_fields(fields, Departure)
+    if stations.strip().upper() == "ALL":
+        abbrs = station_registry.abbrs()
+    else:
+        # Deduplicate while keeping the caller's order
+        abbrs = list(dict.fromkeys(a.strip().upper() for a in stations.split(",") if a.strip()))
+    if len(abbrs) > BATCH_MAX_STATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_STATIONS} stations per request")
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def load(abbr: str) -> dict:
+        async with semaphore:
+            try:
+                return await load_departures(abbr)
+            except HTTPException as e:
+                return {"success": False, "station_abbr": abbr, "error": e.detail}
+    
+    results = await asyncio.gather(*(load(abbr) for abbr in abbrs))
+    failed = sum(1 for r in results if not r["success"])
+    for r in results:
+        RESPONSE_SOURCE.inc(endpoint="departures_batch", source=r.get("source", "error"))
+    # Demo or failed entries must not be cached downstream, as for a single station
+    degraded = failed or any(r.get("source") == "demo" for r in results)
+    
+    return FastJSONResponse(encode_with_items({
+        "success": True,
+        "count": len(results),
+        "failed": failed,
+        "snapshot_age": round(etd_poller.age(), 1) if etd_poller.age() is not None else None
+    }, "stations", [encode_departures(r, fields, view == "grouped") for r in results]),
+        headers={"Cache-Control": "no-cache"} if degraded else None)
+
+
+@app.get("/api/trip")
+async def get_trip(
+    orig: str = Query(..., min_length=4, max_length=4, description="Origin station abbreviation"),
+    dest: str = Query(..., min_length=4, max_length=4, description="Destination station abbreviation"),
+    limit: int = Query(3, ge=1, le=TRIP_MAX_ITINERARIES, description="Number of itineraries")
+):
+    """
+    Next trips between two BART stations, with transfers
+    The route comes from the precomputed line graph; live departures at the
+    origin and each transfer station are matched onto it, so no extra upstream calls.
+    
+    - **orig** / **dest**: station abbreviations, e.g. EMBR and SFIA
+    """
+    orig, dest = orig.upper(), dest.upper()
+    for abbr in (orig, dest):
+        if abbr not in trip_planner:
+            raise HTTPException(status_code=400, detail=f"Invalid station abbreviation: {abbr}")
+    route = trip_planner.route(orig, dest)
+    if route is None:
+        raise HTTPException(status_code=400, detail="Origin and destination must be different stations")
+    
+    boarding = await asyncio.gather(*(load_departures(leg.origin) for leg in route.legs))
+    source = "demo" if any(payload["source"] == "demo" for payload in boarding) else "live"
+    RESPONSE_SOURCE.inc(endpoint="trip", source=source)
+    itineraries = trip_planner.itineraries(
+        route, {payload["station_abbr"]: payload["departures"] for payload in boarding}, limit
+    )
+    # snapshot_age is left out of the ETag, as for departures
+    body = encode({
+        "success": True,
+        "source": source,
+        "orig": orig,
+        "orig_name": station_registry.name(orig, orig),
+        "dest": dest,
+        "dest_name": station_registry.name(dest, dest),
+        "route": {
+            "travel_minutes": route.travel_minutes,
+            "transfer_stations": route.transfer_stations,
+            "legs": [leg.to_dict() for leg in route.legs],
+        },
+        "count": len(itineraries),
+        "itineraries": itineraries
+    }).extend({"snapshot_age": boarding[0].get("snapshot_age")})
+    return FastJSONResponse(body, headers={"Cache-Control": "no-cache"} if source == "demo" else None)
 
 
 @app.get("/api/weather")
-async def get_weather():
+async def get_weather(lat: Optional[float] = None, lon: Optional[float] = None, station: Optional[str] = None):
     """
-    Get current weather for San Francisco using Open Meteo API
+    Get current weather using Open Meteo API (San Francisco by default)
     URL: https://api.open-meteo.com/v1/forecast?latitude=37.7749&longitude=-122.4194&current_weather=true&hourly=precipitation,rain&timezone=America/Los_Angeles
     Open Meteo is FREE and requires NO API key
+    
+    - **lat**/**lon**: any coordinate, snapped to a ~2 km grid cell
+    - **station**: BART station abbreviation (e.g., ANTC, BERY)
     """
-    async with await get_client() as client:
-        try:
-            response = await client.get(
-                f"{OPEN_METEO_BASE_URL}/forecast",
-                params={
-                    "latitude": SF_LAT,
-                    "longitude": SF_LON,
-                    "current_weather": "true",
-                    "hourly": "precipitation,rain",
-                    "timezone": "America/Los_Angeles"
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
-            weather = normalize_open_meteo_weather(data)
-            
-            return {
-                "success": True,
-                "source": "live",
-                "api": "Open Meteo (FREE)",
-                **weather
-            }
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"Weather API error: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+    lat, lon, label = resolve_location(lat, lon, station)
+    cell = snap_to_grid(lat, lon)
+    try:
+        weather = await response_cache.get_or_fetch(
+            conditions_cache_key("weather", cell), lambda: fetch_weather(*cell),
+            ttl=WEATHER_TTL, stale_ttl=WEATHER_STALE_TTL
+        )
+        return {
+            "success": True,
+            "source": "live",
+            "api": "Open Meteo (FREE)",
+            **weather,
+            "city": label,
+            "grid": {"lat": cell[0], "lon": cell[1]}
+        }
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Weather API error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
 
 @app.get("/api/aqi")
-async def get_aqi():
+async def get_aqi(lat: Optional[float] = None, lon: Optional[float] = None, station: Optional[str] = None):
     """
-    Get Air Quality Index (AQI) for San Francisco using Open Meteo Air Quality API
+    Get Air Quality Index (AQI) using Open Meteo Air Quality API (San Francisco by default)
     Open Meteo Air Quality is FREE and requires NO API key
+    
+    - **lat**/**lon**: any coordinate, snapped to a ~2 km grid cell
+    - **station**: BART station abbreviation (e.g., ANTC, BERY)
     """
-    async with await get_client() as client:
-        try:
-            response = await client.get(
-                f"{OPEN_METEO_AQI_URL}/air-quality",
-                params={
-                    "latitude": SF_LAT,
-                    "longitude": SF_LON,
-                    "current": "us_aqi,pm10,pm2_5,carbon_monoxide,nitrogen_dioxide,ozone",
-                    "timezone": "America/Los_Angeles"
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            current = data.get("current", {})
-            aqi_value = current.get("us_aqi", 0)
-            aqi_info = get_aqi_level(aqi_value)
-            
-            return {
-                "success": True,
-                "source": "live",
-                "api": "Open Meteo Air Quality (FREE)",
-                "city": "San Francisco",
-                "aqi": aqi_value,
-                "aqi_level": aqi_info["level"],
-                "aqi_color": aqi_info["color"],
-                "aqi_icon": aqi_info["icon"],
-                "pollutants": {
-                    "pm2_5": current.get("pm2_5", 0),
-                    "pm10": current.get("pm10", 0),
-                    "ozone": current.get("ozone", 0),
-                    "nitrogen_dioxide": current.get("nitrogen_dioxide", 0),
-                    "carbon_monoxide": current.get("carbon_monoxide", 0)
-                }
-            }
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"AQI API error: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+    lat, lon, label = resolve_location(lat, lon, station)
+    cell = snap_to_grid(lat, lon)
+    try:
+        aqi = await response_cache.get_or_fetch(
+            conditions_cache_key("aqi", cell), lambda: fetch_aqi(*cell),
+            ttl=AQI_TTL, stale_ttl=AQI_STALE_TTL
+        )
+        return {
+            "success": True,
+            "source": "live",
+            "api": "Open Meteo Air Quality (FREE)",
+            **aqi,
+            "city": label,
+            "grid": {"lat": cell[0], "lon": cell[1]}
+        }
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"AQI API error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+class NearestPoint(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+
+
+class NearestBulkRequest(BaseModel):
+    points: List[NearestPoint]
+    k: int = Field(1, ge=1, le=10)
+
+
+def nearest_result(matches: list) -> list:
+    return [{**station.to_dict(), "distance_km": round(distance, 3)} for distance, station in matches]
+
+
+@app.get("/api/nearest")
+async def get_nearest_stations(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude"),
+    k: int = Query(3, ge=1, le=10, description="Number of stations")
+):
+    """
+    Find the k closest BART stations to a point (haversine distance)
+    Answered from the in-memory station index, no upstream call
+    """
+    stations = nearest_result(station_registry.nearest(lat, lon, k))
+    return {
+        "success": True,
+        "lat": lat,
+        "lon": lon,
+        "count": len(stations),
+        "stations": stations
+    }
+
+
+@app.post("/api/nearest/bulk")
+async def get_nearest_stations_bulk(request: NearestBulkRequest):
+    """
+    Find the k closest BART stations for many points in a single vectorized pass
+    Body: {"points": [{"lat": 37.79, "lon": -122.39}, ...], "k": 1}
+    """
+    if len(request.points) > NEAREST_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"At most {NEAREST_MAX_POINTS} points per request")
+    
+    matches = station_registry.nearest_many([(p.lat, p.lon) for p in request.points], request.k)
+    return {
+        "success": True,
+        "count": len(matches),
+        "results": [
+            {"lat": p.lat, "lon": p.lon, "stations": nearest_result(m)}
+            for p, m in zip(request.points, matches)
+        ]
+    }
+
+
+@app.get("/api/stream")
+async def stream_updates(
+    stations: str = Query("", description="Comma-separated station abbreviations"),
+    weather: bool = Query(False, description="Include weather updates"),
+    aqi: bool = Query(False, description="Include air quality updates")
+):
+    """
+    Server-Sent Events stream of live departures, weather and AQI
+    Sends a snapshot on connect, then an event only when a subscribed payload changes:
+    departures_diff (added trains, removed and changed ones by id) for departures,
+    the full payload for weather and aqi.
+    
+    - **stations**: e.g. EMBR,POWL
+    """
+    keys = [f"departures:{a.strip().upper()}" for a in stations.split(",") if a.strip()]
+    if weather:
+        keys.append("weather")
+    if aqi:
+        keys.append("aqi")
+    if not keys:
+        raise HTTPException(status_code=400, detail="Subscribe to at least one station, weather or aqi")
+    if len(keys) > BATCH_MAX_STATIONS + 2:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_STATIONS} stations per stream")
+    
+    return StreamingResponse(
+        sse_events(stream_hub, keys, keepalive=STREAM_KEEPALIVE),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/stream/status")
+async def get_stream_status():
+    """Live update hub state: subscribers, events sent and slow-consumer resyncs"""
+    return {
+        "success": True,
+        **stream_hub.stats()
+    }
+
+
+@app.get("/api/poller/status")
+async def get_poller_status():
+    """Background ETD poller state and snapshot age, station weather/AQI prefetch and the shared store"""
+    prefetched = conditions_poller.snapshot
+    # SQLiteStore.stats() queries the store file
+    store_stats = await asyncio.get_running_loop().run_in_executor(None, shared_store.stats)
+    return {
+        "success": True,
+        **etd_poller.stats(),
+        "conditions_prefetch": {
+            **conditions_poller.stats(),
+            "last_result": {
+                "cells": prefetched["cells"],
+                "weather": bool(prefetched["weather"]),
+                "aqi": bool(prefetched["aqi"])
+            } if prefetched else None
+        },
+        "shared_store": store_stats
+    }
+
+
+@app.get("/api/conditions")
+async def get_conditions(lat: Optional[float] = None, lon: Optional[float] = None, station: Optional[str] = None):
+    """
+    Get current weather and air quality in one response (San Francisco by default)
+    Both Open Meteo requests run concurrently through the shared cache and
+    connection pool; if one side fails the other is still returned.
+    """
+    resolve_location(lat, lon, station)
+    results = await asyncio.gather(
+        get_weather(lat, lon, station), get_aqi(lat, lon, station), return_exceptions=True
+    )
+    weather, aqi = [
+        {"success": False, "error": r.detail} if isinstance(r, HTTPException)
+        else {"success": False, "error": f"Server error: {str(r)}"} if isinstance(r, Exception)
+        else r
+        for r in results
+    ]
+    body = {
+        "success": weather["success"] or aqi["success"],
+        "weather": weather,
+        "aqi": aqi
+    }
+    # A failed side must not be cached downstream for the full weather max-age
+    degraded = not (weather["success"] and aqi["success"])
+    return FastJSONResponse(body, headers={"Cache-Control": "no-cache"} if degraded else None)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics in text exposition format"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/ready")
+async def get_readiness():
+    """
+    Readiness probe: 503 until the startup warm-up has finished or hit
+    WARMUP_DEADLINE, and again once shutdown begins. Includes per-step timings.
+    """
+    stats = warmup.stats()
+    return FastJSONResponse({"success": stats["ready"], **stats}, status_code=200 if stats["ready"] else 503)
+
+
+@app.get("/api/health/upstreams")
+async def get_upstream_health():
+    """Circuit breaker state, recent latency and error rate for each upstream API"""
+    upstream_info = upstreams.info()
+    return {
+        "success": True,
+        "healthy": all(u["circuit"]["state"] == "closed" for u in upstream_info.values()),
+        "upstreams": upstream_info
+    }
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Response cache hit/miss/staleness counters, upstream request coalescing and precomputed trip routes"""
+    return {
+        "success": True,
+        **response_cache.stats(),
+        "coalescing": upstreams.flights.stats(),
+        "encoded": encoded_bodies.stats(),
+        "trip_routes": trip_planner.stats()
+    }
+
+
+@app.get("/api/history/delays")
+async def get_delay_history(
+    station: Optional[str] = Query(None, description="Station abbreviation; all stations if omitted"),
+    hours: float = Query(24, gt=0, le=HISTORY_RETENTION_DAYS * 24, description="Window ending now, in hours")
+):
+    """
+    Delay percentiles per station and line color from recorded ETD snapshots
+    Each sample is one estimate in one polled snapshot. Requires HISTORY_DIR.
+    
+    - **station**: e.g. EMBR
+    - **hours**: look-back window, e.g. 168 for a week
+    """
+    if etd_history is None:
+        raise HTTPException(status_code=503, detail="ETD history is not being recorded (set HISTORY_DIR)")
+    until = time.time()
+    since = until - hours * 3600
+    station = station.upper() if station else None
+    # Aggregation reads up to months of column files; keep it off the event loop
+    stations = await asyncio.get_running_loop().run_in_executor(
+        None, etd_history.delay_stats, since, until, station
+    )
+    for entry in stations:
+        entry["station_name"] = station_registry.name(entry["station"], entry["station"])
+    return {
+        "success": True,
+        "since": int(since),
+        "until": int(until),
+        "count": len(stations),
+        "stations": stations
+    }
+
+
+@app.get("/api/history/status")
+async def get_history_status():
+    """ETD history recorder state: days kept, bytes on disk, snapshots and rows written"""
+    return {
+        "success": True,
+        "enabled": etd_history is not None,
+        **(etd_history.stats() if etd_history is not None else {})
+    }
 
 
 @app.get("/api/search")
 async def search_location(q: str = Query(..., min_length=2, description="Search query")):
     """
-    Search for locations in San Francisco Bay Area using OpenStreetMap Nominatim
+    Search for locations in San Francisco Bay Area
+    BART stations and common landmarks are matched locally (prefix + typo-tolerant);
+    other queries go through a persistent geocode cache, then rate-limited Nominatim.
     Nominatim is FREE and requires NO API key
     
     - **q**: Search query (e.g., "Golden Gate Bridge", "Mission District")
     """
-    async with await get_client() as client:
-        try:
-            response = await client.get(
-                f"{NOMINATIM_BASE_URL}/search",
-                params={
-                    "q": f"{q}, San Francisco, CA",
-                    "format": "json",
-                    "limit": 5,
-                    "addressdetails": 1
-                },
-                headers={
-                    "User-Agent": "SFTransitWeatherApp/1.0 (transit-demo)"
-                }
-            )
-            response.raise_for_status()
-            results = response.json()
-            
-            # Normalize results
-            locations = [
-                {
-                    "name": r.get("display_name"),
-                    "lat": float(r.get("lat", 0)),
-                    "lon": float(r.get("lon", 0)),
-                    "type": r.get("type"),
-                    "importance": r.get("importance")
-                }
-                for r in results
-            ]
-            
-            return {
-                "success": True,
-                "query": q,
-                "count": len(locations),
-                "results": locations,
-                "api": "Nominatim (FREE)"
-            }
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"Geocoding API error: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+    query = normalize_query(q)
+    
+    # Stations and landmarks are answered locally, without touching Nominatim
+    local = place_index.search(q, limit=5)
+    if local:
+        RESPONSE_SOURCE.inc(endpoint="search", source="local")
+        return {
+            "success": True,
+            "query": q,
+            "count": len(local),
+            "results": local,
+            "source": "local",
+            "api": "Local station & landmark index"
+        }
+    
+    loop = asyncio.get_running_loop()
+
+    async def geocode() -> list:
+        locations = await fetch_geocode(q)
+        # Written once per coalesced lookup; SQLite stays off the event loop
+        await loop.run_in_executor(None, geocode_cache.put, query, locations)
+        return locations
+
+    try:
+        locations = await loop.run_in_executor(None, geocode_cache.get, query)
+        source = "cached"
+        if locations is None:
+            locations = await geocode_flights.do(query, geocode)
+            source = "live"
+        RESPONSE_SOURCE.inc(endpoint="search", source=source)
+        
+        return {
+            "success": True,
+            "query": q,
+            "count": len(locations),
+            "results": locations,
+            "source": source,
+            "api": "Nominatim (FREE)"
+        }
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=503, detail=f"Geocoding busy, retry later ({e})",
+                            headers={"Retry-After": str(math.ceil(e.wait))})
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Geocoding API error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+@app.get("/api/search/stats")
+async def get_search_stats():
+    """Geocode cache counters and Nominatim rate limiter queue"""
+    cache_stats = await asyncio.get_running_loop().run_in_executor(None, geocode_cache.stats)
+    return {
+        "success": True,
+        "local_places": len(place_index.places),
+        "cache": cache_stats,
+        "limiter": {
+            "rate_per_second": nominatim_limiter.rate,
+            "waiting": nominatim_limiter.waiting,
+            "max_wait": nominatim_limiter.max_wait,
+            "rejected": nominatim_limiter.rejected
+        },
+        "coalescing": geocode_flights.stats()
+    }
 
 
 # Run with: uvicorn main:app --reload --port 8000
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # More than one worker needs SHARED_CACHE_BACKEND=sqlite (or redis) to poll upstreams once
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)
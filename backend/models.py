@@ -0,0 +1,167 @@
+"""
+Compact record types for BART stations and departures
+Slotted dataclasses parsed once from BART's string fields: minutes, length and
+delay become ints; line colors and directions share one canonical string per
+enum value. Records are shared across requests and must not be mutated.
+Also the ?fields= projection and grouped-by-destination departure formats.
+"""
+
+import sys
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterable, List, Optional, Tuple
+
+
+class LineColor(str, Enum):
+    RED = "RED"
+    ORANGE = "ORANGE"
+    YELLOW = "YELLOW"
+    GREEN = "GREEN"
+    BLUE = "BLUE"
+    BEIGE = "BEIGE"
+    WHITE = "WHITE"
+    GREY = "GREY"
+
+
+class Direction(str, Enum):
+    NORTH = "North"
+    SOUTH = "South"
+    EAST = "East"
+    WEST = "West"
+
+
+# Enum value -> the enum's own (shared) value string. Plain strings are stored
+# rather than members: they compare equal to the members, and serialize faster.
+_COLORS = {member.value: member.value for member in LineColor}
+_DIRECTIONS = {member.value: member.value for member in Direction}
+
+
+def _canonical(values: dict, value) -> Optional[str]:
+    """Shared string for a known enum value; unknown values are interned"""
+    found = values.get(value)
+    if found is not None or value is None:
+        return found
+    return sys.intern(str(value))
+
+
+def _intern(value) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _int(value, default: int = 0) -> int:
+    """BART numeric strings to int; "Leaving" and other non-numbers become default"""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return default
+
+
+class Record:
+    """Shared helpers for slotted dataclasses"""
+
+    __slots__ = ()
+
+    def to_dict(self, fields: Optional[Tuple[str, ...]] = None) -> dict:
+        return {name: getattr(self, name) for name in fields or self.__slots__}
+
+    @classmethod
+    def select(cls, requested: Iterable[str]) -> Tuple[str, ...]:
+        """Requested field names in record order; ValueError names any unknown ones"""
+        requested = {name.strip() for name in requested if name.strip()}
+        unknown = requested.difference(cls.__slots__)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))} (available: {', '.join(cls.__slots__)})")
+        return tuple(name for name in cls.__slots__ if name in requested)
+
+
+@dataclass
+class Station(Record):
+    __slots__ = ("abbr", "name", "lat", "lon", "city", "address", "zipcode")
+    abbr: str
+    name: str
+    lat: float
+    lon: float
+    city: Optional[str]
+    address: Optional[str]
+    zipcode: Optional[str]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Station":
+        """From a normalized dict (abbr, name, lat, lon, optional city/address/zipcode)"""
+        return cls(
+            abbr=_intern(data.get("abbr")),
+            name=data.get("name"),
+            lat=float(data.get("lat") or 0),
+            lon=float(data.get("lon") or 0),
+            city=_intern(data.get("city")),
+            address=data.get("address"),
+            zipcode=data.get("zipcode"),
+        )
+
+    @classmethod
+    def from_bart(cls, data: dict) -> "Station":
+        """From one entry of a BART stn.aspx response"""
+        return cls(
+            abbr=_intern(data.get("abbr")),
+            name=data.get("name"),
+            lat=float(data.get("gtfs_latitude") or 0),
+            lon=float(data.get("gtfs_longitude") or 0),
+            city=_intern(data.get("city")),
+            address=data.get("address"),
+            zipcode=data.get("zipcode"),
+        )
+
+
+@dataclass
+class Departure(Record):
+    __slots__ = ("destination", "minutes", "platform", "direction", "length", "color", "hexcolor", "delay")
+    destination: str
+    minutes: int  # 0 while the train is leaving
+    platform: str
+    direction: Optional[str]  # a Direction value when known
+    length: int  # cars
+    color: Optional[str]  # a LineColor value when known
+    hexcolor: str
+    delay: int  # seconds
+
+    @classmethod
+    def from_bart(cls, destination: str, estimate: dict) -> "Departure":
+        """From one estimate of a BART etd.aspx response"""
+        return cls(
+            destination=_intern(destination),
+            minutes=_int(estimate.get("minutes")),
+            platform=_intern(estimate.get("platform")),
+            direction=_canonical(_DIRECTIONS, estimate.get("direction")),
+            length=_int(estimate.get("length")),
+            color=_canonical(_COLORS, estimate.get("color")),
+            hexcolor=_intern(estimate.get("hexcolor")),
+            delay=_int(estimate.get("delay")),
+        )
+
+
+# Grouped departures: one entry per (destination, line, direction, platform)
+# carrying the shared strings once and the per-train values as lists
+GROUP_KEYS = ("destination", "color", "hexcolor", "direction", "platform")
+GROUP_LISTS = ("minutes", "length", "delay")
+
+
+def group_departures(departures: Iterable[Departure], fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+    """
+    Departures grouped by destination and line, in first-departure order. fields
+    limits the keys, and groups are formed on the kept keys only, so e.g.
+    fields=destination,minutes gives one entry per destination.
+    """
+    keys = [name for name in GROUP_KEYS if not fields or name in fields]
+    lists = [name for name in GROUP_LISTS if not fields or name in fields]
+    groups = {}
+    for departure in departures:
+        group_key = tuple(getattr(departure, name) for name in keys)
+        group = groups.get(group_key)
+        if group is None:
+            group = groups[group_key] = {name: getattr(departure, name) for name in keys}
+            for name in lists:
+                group[name] = []
+        for name in lists:
+            group[name].append(getattr(departure, name))
+    return list(groups.values())
@@ -0,0 +1,304 @@
+"""
+BART network graph and trip planning
+Lines are ordered station lists from a bundled snapshot of BART's routes, with
+approximate run times between neighbouring stations. The fastest route between
+every pair of stations, including its transfer points, is precomputed once;
+a trip query only matches live departures against that route, so it never
+calls upstream.
+"""
+
+import heapq
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import timed
+
+# Routing cost of changing trains, in minutes (walk plus a typical wait), so a
+# route with a transfer has to save real time over a direct one
+TRANSFER_PENALTY_MINUTES = 5
+
+# Minimum time between arriving at a transfer station and the connecting departure
+MIN_CONNECTION_MINUTES = 1
+
+# Bundled route snapshot: (color, hexcolor, typical headway in minutes,
+# stations as (abbr, minutes from the previous station)). Each line runs both ways.
+# Red and Yellow run on to Millbrae via SFO; short runs terminate at SFO.
+BART_LINES = (
+    ("YELLOW", "#ffff33", 15, (
+        ("ANTC", 0), ("PCTR", 7), ("PITT", 4), ("NCON", 5), ("CONC", 3), ("PHIL", 4),
+        ("WCRK", 3), ("LAFY", 4), ("ORIN", 4), ("ROCK", 5), ("MCAR", 3), ("19TH", 3),
+        ("12TH", 2), ("WOAK", 4), ("EMBR", 7), ("MONT", 1), ("POWL", 2), ("CIVC", 1),
+        ("16TH", 3), ("24TH", 2), ("GLEN", 3), ("BALB", 2), ("DALY", 4), ("COLM", 3),
+        ("SSAN", 3), ("SBRN", 3), ("SFIA", 5), ("MLBR", 5),
+    )),
+    ("RED", "#ff0000", 15, (
+        ("RICH", 0), ("DELN", 3), ("PLZA", 3), ("NBRK", 3), ("DBRK", 2), ("ASHB", 3),
+        ("MCAR", 3), ("19TH", 3), ("12TH", 2), ("WOAK", 4), ("EMBR", 7), ("MONT", 1),
+        ("POWL", 2), ("CIVC", 1), ("16TH", 3), ("24TH", 2), ("GLEN", 3), ("BALB", 2),
+        ("DALY", 4), ("COLM", 3), ("SSAN", 3), ("SBRN", 3), ("SFIA", 5), ("MLBR", 5),
+    )),
+    ("ORANGE", "#ff9933", 15, (
+        ("RICH", 0), ("DELN", 3), ("PLZA", 3), ("NBRK", 3), ("DBRK", 2), ("ASHB", 3),
+        ("MCAR", 3), ("19TH", 3), ("12TH", 2), ("LAKE", 3), ("FTVL", 4), ("COLS", 4),
+        ("SANL", 3), ("BAYF", 4), ("HAYW", 4), ("SHAY", 3), ("UCTY", 5), ("FRMT", 4),
+        ("WARM", 6), ("MLPT", 6), ("BERY", 4),
+    )),
+    ("GREEN", "#339933", 15, (
+        ("BERY", 0), ("MLPT", 4), ("WARM", 6), ("FRMT", 6), ("UCTY", 4), ("SHAY", 5),
+        ("HAYW", 3), ("BAYF", 4), ("SANL", 4), ("COLS", 3), ("FTVL", 4), ("LAKE", 4),
+        ("WOAK", 6), ("EMBR", 7), ("MONT", 1), ("POWL", 2), ("CIVC", 1), ("16TH", 3),
+        ("24TH", 2), ("GLEN", 3), ("BALB", 2), ("DALY", 4),
+    )),
+    ("BLUE", "#0099cc", 15, (
+        ("DUBL", 0), ("WDUB", 3), ("CAST", 9), ("BAYF", 6), ("SANL", 4), ("COLS", 3),
+        ("FTVL", 4), ("LAKE", 4), ("WOAK", 6), ("EMBR", 7), ("MONT", 1), ("POWL", 2),
+        ("CIVC", 1), ("16TH", 3), ("24TH", 2), ("GLEN", 3), ("BALB", 2), ("DALY", 4),
+    )),
+    ("BEIGE", "#d5cfa3", 6, (
+        ("COLS", 0), ("OAKL", 8),
+    )),
+)
+
+# ETD destination names that differ from the terminal station's name
+HEADSIGN_ALIASES = {
+    "SFO Airport": "SFIA",
+    "SF Airport": "SFIA",
+    "SFO": "SFIA",
+    "SFO/Millbrae": "MLBR",
+    "Millbrae/SFO": "SFIA",
+    "OAK Airport": "OAKL",
+    "Oakland Airport": "OAKL",
+    "Montgomery": "MONT",
+}
+
+
+class Pattern:
+    """One direction of one line"""
+
+    def __init__(self, color: str, hexcolor: str, headway: int, stations: Tuple[str, ...], minutes: Tuple[int, ...]):
+        self.color = color
+        self.hexcolor = hexcolor
+        self.headway = headway
+        self.stations = stations
+        self.minutes = minutes  # minutes[i]: run time from stations[i - 1] to stations[i]
+        self.index = {abbr: i for i, abbr in enumerate(stations)}
+
+
+@dataclass
+class Leg:
+    """One ride without changing trains; shared by every trip over the same route"""
+    origin: str
+    dest: str
+    stops: int
+    ride_minutes: int
+    lines: Tuple[str, ...]  # colors with a direct train from origin to dest
+    headway: int
+    serves: frozenset  # (color, terminal abbr) pairs of trains that go from origin to dest
+
+    def to_dict(self) -> dict:
+        return {
+            "from": self.origin,
+            "to": self.dest,
+            "lines": self.lines,
+            "stops": self.stops,
+            "ride_minutes": self.ride_minutes,
+        }
+
+
+@dataclass
+class Route:
+    """Fastest way between two stations, ignoring waits"""
+    legs: Tuple[Leg, ...]
+    travel_minutes: int  # riding time plus TRANSFER_PENALTY_MINUTES per transfer
+
+    @property
+    def transfer_stations(self) -> Tuple[str, ...]:
+        return tuple(leg.origin for leg in self.legs[1:])
+
+
+class TripPlanner:
+    """Precomputed all-pairs routes plus matching of live departures onto them"""
+
+    def __init__(self, lines: Iterable[tuple] = BART_LINES, names: Optional[Dict[str, str]] = None):
+        start = time.perf_counter()
+        self.patterns = []
+        for color, hexcolor, headway, stops in lines:
+            stations = tuple(abbr for abbr, _ in stops)
+            runs = tuple(minutes for _, minutes in stops)
+            self.patterns.append(Pattern(color, hexcolor, headway, stations, runs))
+            # The reverse direction: run time into stations[i] is the forward time out of it
+            self.patterns.append(Pattern(color, hexcolor, headway, stations[::-1], (0,) + runs[:0:-1]))
+        self.at_station = {}
+        for p, pattern in enumerate(self.patterns):
+            for abbr in pattern.stations:
+                self.at_station.setdefault(abbr, []).append(p)
+        self.hexcolors = {pattern.color: pattern.hexcolor for pattern in self.patterns}
+
+        self.headsigns = dict(HEADSIGN_ALIASES)
+        for abbr, name in (names or {}).items():
+            if abbr in self.at_station:
+                # "Berryessa/North San José" is signed "Berryessa"
+                self.headsigns.setdefault(name, abbr)
+                self.headsigns.setdefault(name.split("/")[0].strip(), abbr)
+
+        self.routes = {}
+        for origin in self.at_station:
+            self.routes.update(self._search(origin))
+        self.precompute_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def __contains__(self, abbr: str) -> bool:
+        return abbr in self.at_station
+
+    def _search(self, origin: str) -> dict:
+        """Dijkstra from origin over (pattern, position) states; boarding at origin is free"""
+        heap = []
+        costs = {}
+        parent = {}
+        for p in self.at_station[origin]:
+            state = (p, self.patterns[p].index[origin])
+            costs[state] = 0
+            parent[state] = None
+            heapq.heappush(heap, (0, 0, state))
+        settled = set()
+        reached = {}  # station -> (first settled state, cost)
+        while heap:
+            cost, transfers, state = heapq.heappop(heap)
+            if state in settled:
+                continue
+            settled.add(state)
+            p, i = state
+            pattern = self.patterns[p]
+            abbr = pattern.stations[i]
+            reached.setdefault(abbr, (state, cost))
+
+            moves = []
+            if i + 1 < len(pattern.stations):
+                moves.append(((p, i + 1), cost + pattern.minutes[i + 1], transfers))
+            if abbr != origin:
+                for q in self.at_station[abbr]:
+                    if q != p:
+                        moves.append(((q, self.patterns[q].index[abbr]), cost + TRANSFER_PENALTY_MINUTES, transfers + 1))
+            for next_state, next_cost, next_transfers in moves:
+                if next_cost < costs.get(next_state, math.inf):
+                    costs[next_state] = next_cost
+                    parent[next_state] = state
+                    heapq.heappush(heap, (next_cost, next_transfers, next_state))
+
+        routes = {}
+        for dest, (state, cost) in reached.items():
+            if dest == origin:
+                continue
+            path = []
+            while state is not None:
+                path.append(state)
+                state = parent[state]
+            routes[(origin, dest)] = Route(self._legs(path[::-1]), cost)
+        return routes
+
+    def _legs(self, path: List[tuple]) -> Tuple[Leg, ...]:
+        """Split a state path into rides on one pattern each"""
+        legs = []
+        start = 0
+        for k in range(1, len(path) + 1):
+            if k == len(path) or path[k][0] != path[start][0]:
+                (p, i), (_, j) = path[start], path[k - 1]
+                if j > i:
+                    legs.append(self._leg(self.patterns[p], i, j))
+                start = k
+        return tuple(legs)
+
+    def _leg(self, pattern: Pattern, i: int, j: int) -> Leg:
+        origin, dest = pattern.stations[i], pattern.stations[j]
+        lines = []
+        serves = set()
+        headway = pattern.headway
+        for p in self.at_station[origin]:
+            other = self.patterns[p]
+            a, b = other.index[origin], other.index.get(dest)
+            if b is None or b <= a:
+                continue
+            if other.color not in lines:
+                lines.append(other.color)
+            headway = min(headway, other.headway)
+            serves.update((other.color, terminal) for terminal in other.stations[b:])
+        return Leg(origin, dest, j - i, sum(pattern.minutes[i + 1:j + 1]), tuple(lines), headway, frozenset(serves))
+
+    def route(self, origin: str, dest: str) -> Optional[Route]:
+        return self.routes.get((origin, dest))
+
+    def terminal(self, destination: str) -> Optional[str]:
+        """Station abbreviation for an ETD destination name"""
+        return self.headsigns.get(destination)
+
+    def _next_train(self, leg: Leg, departures: Iterable, earliest: int):
+        """First departure at leg.origin that rides to leg.dest and leaves at or after earliest"""
+        for departure in departures:
+            if departure.minutes >= earliest and (departure.color, self.headsigns.get(departure.destination)) in leg.serves:
+                return departure
+        return None
+
+    @timed("plan_trip")
+    def itineraries(self, route: Route, departures: Dict[str, tuple], limit: int) -> List[dict]:
+        """
+        Next trips along route. departures maps each boarding station to its live
+        departures; a connection with no live train in range is estimated from the
+        line's headway and marked live=False.
+        """
+        by_station = {abbr: sorted(rows, key=lambda d: d.minutes) for abbr, rows in departures.items()}
+        first = route.legs[0]
+        trips = []
+        for train in by_station.get(first.origin, ()):
+            if len(trips) > limit:
+                break
+            if (train.color, self.headsigns.get(train.destination)) not in first.serves:
+                continue
+            legs = [self._ride(first, train, train.minutes)]
+            for leg in route.legs[1:]:
+                earliest = legs[-1]["arrive_in"] + MIN_CONNECTION_MINUTES
+                connection = self._next_train(leg, by_station.get(leg.origin, ()), earliest)
+                if connection is not None:
+                    legs.append(self._ride(leg, connection, connection.minutes))
+                else:
+                    legs.append(self._ride(leg, None, earliest + math.ceil(leg.headway / 2)))
+            trip = {
+                "depart_in": legs[0]["depart_in"],
+                "arrive_in": legs[-1]["arrive_in"],
+                "duration": legs[-1]["arrive_in"] - legs[0]["depart_in"],
+                "transfers": len(legs) - 1,
+                "legs": legs,
+            }
+            # A later train that makes the same connection is the better choice
+            if trips and trips[-1]["arrive_in"] >= trip["arrive_in"]:
+                trips[-1] = trip
+            else:
+                trips.append(trip)
+        return trips[:limit]
+
+    def _ride(self, leg: Leg, train, depart_in: int) -> dict:
+        if train is None:
+            color = leg.lines[0]
+            destination = None
+            hexcolor = self.hexcolors.get(color)
+        else:
+            color, destination, hexcolor = train.color, train.destination, train.hexcolor
+        return {
+            "from": leg.origin,
+            "to": leg.dest,
+            "color": color,
+            "hexcolor": hexcolor,
+            "destination": destination,
+            "depart_in": depart_in,
+            "arrive_in": depart_in + leg.ride_minutes,
+            "stops": leg.stops,
+            "live": train is not None,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "lines": len(self.patterns) // 2,
+            "stations": len(self.at_station),
+            "routes": len(self.routes),
+            "precompute_ms": self.precompute_ms,
+        }
@@ -0,0 +1,195 @@
+"""
+Background snapshot poller
+Calls a fetch function on a fixed interval and keeps the latest result in
+memory, e.g. system-wide BART departures keyed by station abbreviation.
+With a shared store, workers elect one leader per poller: the leader fetches
+and publishes, followers adopt the published snapshot without calling upstream.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from serialize import dumps
+from shared import LocalStore, owner_id
+
+
+class SnapshotPoller:
+    """Keeps the latest fetch() result hot; fetch() returns a dict snapshot"""
+
+    def __init__(self, fetch: Callable[[], Awaitable[dict]], interval: float, name: Optional[str] = None,
+                 store: Optional[LocalStore] = None, decode: Optional[Callable[[Any], dict]] = None,
+                 on_update: Optional[Callable[[dict], None]] = None):
+        """
+        name/store: share snapshots through store under this name (needed once store.shared)
+        decode: rebuilds a snapshot from its JSON form when read from the store
+        on_update: called with every newly installed snapshot, fetched or adopted
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.name = name or getattr(fetch, "__name__", "snapshot")
+        self.store = store
+        self.decode = decode or (lambda data: data)
+        self.on_update = on_update
+        self.snapshot = None
+        self.updated_at = None  # time.monotonic() of the last successful poll
+        self.fetched_at = None  # wall-clock time of the last successful poll
+        self.last_error = None
+        self.leader = None  # None until the first election when sharing
+        self.counters = {"polls": 0, "successes": 0, "failures": 0, "adopted": 0}
+        self.task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def sharing(self) -> bool:
+        return self.store is not None and self.store.shared
+
+    @property
+    def ready(self) -> bool:
+        """True once at least one poll has succeeded"""
+        return self.snapshot is not None
+
+    @property
+    def authoritative(self) -> bool:
+        """True if this process's polls are the only ones: not sharing, or holding the lease"""
+        return not self.sharing or self.leader is True
+
+    @property
+    def lease_ttl(self) -> float:
+        # Long enough to survive a slow fetch, short enough for a quick failover
+        return max(self.interval * 3, 30.0)
+
+    @property
+    def sync_interval(self) -> float:
+        """How often followers look for a newer published snapshot"""
+        return max(0.5, self.interval / 5)
+
+    def age(self) -> Optional[float]:
+        """Seconds since the last successful poll, or None if it never succeeded"""
+        if self.updated_at is None:
+            return None
+        return time.monotonic() - self.updated_at
+
+    def get(self, key: str) -> Optional[dict]:
+        """One entry (e.g. a station's departures) from the current snapshot"""
+        if self.snapshot is None:
+            return None
+        return self.snapshot.get(key)
+
+    def _install(self, snapshot: dict, fetched_at: float):
+        self.snapshot = snapshot
+        # Age counts from the original fetch, even for a snapshot adopted later
+        self.updated_at = time.monotonic() - max(0.0, time.time() - fetched_at)
+        self.fetched_at = fetched_at
+        self.last_error = None
+        if self.on_update is not None:
+            self.on_update(snapshot)
+
+    async def _fetch(self) -> bool:
+        try:
+            snapshot = await self.fetch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Keep the previous snapshot; its age tells clients how stale it is
+            self.counters["failures"] += 1
+            self.last_error = str(e) or type(e).__name__
+            return False
+        self._install(snapshot, time.time())
+        self.counters["successes"] += 1
+        return True
+
+    async def _publish(self):
+        ttl = max(self.lease_ttl * 10, 300.0)
+        await self.store.set(f"snapshot:{self.name}", dumps({"fetched_at": self.fetched_at, "snapshot": self.snapshot}), ttl)
+        await self.store.set(f"snapshot:{self.name}:version", repr(self.fetched_at).encode(), ttl)
+
+    async def _adopt(self) -> bool:
+        """Install the leader's snapshot if it is newer than ours"""
+        version = await self.store.get(f"snapshot:{self.name}:version")
+        if version is None:
+            return self.ready
+        if self.fetched_at is not None and float(version) <= self.fetched_at:
+            return True
+        data = await self.store.get(f"snapshot:{self.name}")
+        if data is None:
+            return self.ready
+        published = json.loads(data)
+        self._install(self.decode(published["snapshot"]), published["fetched_at"])
+        self.counters["adopted"] += 1
+        return True
+
+    async def poll_once(self) -> bool:
+        if not self.sharing:
+            self.counters["polls"] += 1
+            return await self._fetch()
+
+        try:
+            self.leader = await self.store.acquire(f"poller:{self.name}", owner_id(), self.lease_ttl)
+            if not self.leader:
+                return await self._adopt()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Store unavailable: poll upstream directly rather than go stale
+            self.leader = None
+            self.last_error = f"shared store: {e}"
+        self.counters["polls"] += 1
+        if not await self._fetch():
+            return False
+        if self.leader:
+            try:
+                await self._publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = f"shared store: {e}"
+        return True
+
+    @property
+    def next_poll_in(self) -> float:
+        """Seconds to wait after a poll: followers check for new snapshots more often"""
+        return self.sync_interval if self.sharing and not self.leader else self.interval
+
+    async def _run(self, delay: float):
+        await asyncio.sleep(delay)
+        while True:
+            await self.poll_once()
+            await asyncio.sleep(self.next_poll_in)
+
+    def start(self, delay: float = 0):
+        """delay: seconds before the first poll, e.g. after a poll made during warm-up"""
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._run(delay))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.sharing and self.leader:
+            # Hand over right away instead of waiting for the lease to expire
+            try:
+                await self.store.release(f"poller:{self.name}", owner_id())
+            except Exception:
+                pass
+            self.leader = None
+
+    def stats(self) -> dict:
+        age = self.age()
+        return {
+            "enabled": self.enabled,
+            "running": self.task is not None and not self.task.done(),
+            "interval": self.interval,
+            "role": ("leader" if self.leader else "follower") if self.sharing else "standalone",
+            "ready": self.ready,
+            "snapshot_age": round(age, 1) if age is not None else None,
+            "fetched_at": self.fetched_at,
+            "entries": len(self.snapshot) if self.snapshot else 0,
+            "last_error": self.last_error,
+            **self.counters,
+        }
@@ -0,0 +1,136 @@
+"""
+Fast JSON serialization
+orjson-backed response class (stdlib json fallback) plus a memo of encoded
+bodies with precomputed ETags for payloads reused across requests
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Mapping, Optional
+
+from fastapi.responses import JSONResponse
+
+from metrics import stage_timer
+
+try:
+    import orjson
+except ImportError:  # stdlib json produces the same output, just slower
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+
+def _default(value: Any) -> Any:
+    """Slotted records (models.Record) for the stdlib encoder; orjson handles dataclasses itself"""
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON, matching JSONResponse's output format"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the encoded body"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+class EncodedBody:
+    """An already serialized JSON body and its ETag"""
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes, etag: Optional[str] = None):
+        self.body = body
+        self.etag = etag or make_etag(body)
+
+    def extend(self, fields: dict) -> "EncodedBody":
+        """
+        This body (a JSON object) with volatile fields appended, e.g.
+        snapshot_age. The ETag becomes weak: it still describes the stable part.
+        """
+        extra = dumps(fields)
+        if len(extra) <= 2:
+            return self
+        body = self.body[:-1] + (b"," if len(self.body) > 2 else b"") + extra[1:]
+        return EncodedBody(body, self.etag if self.etag.startswith("W/") else "W/" + self.etag)
+
+
+def encode(content: Any) -> EncodedBody:
+    with stage_timer("serialize"):
+        return EncodedBody(dumps(content))
+
+
+def encode_with_items(content: dict, key: str, items: List[EncodedBody]) -> EncodedBody:
+    """
+    content plus key: [items], assembled from already encoded items. The weak
+    ETag covers only the items, so volatile fields in content don't change it.
+    """
+    head = dumps(content)
+    body = b"".join((
+        head[:-1], b"," if len(head) > 2 else b"", dumps(key), b":[",
+        b",".join(item.body for item in items), b"]}",
+    ))
+    return EncodedBody(body, "W/" + make_etag("".join(item.etag for item in items).encode("latin-1")))
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson. Returning one directly from a route
+    also skips FastAPI's jsonable_encoder pass, so content must already be
+    plain JSON types. An EncodedBody is sent as-is with its ETag.
+    """
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Mapping[str, str]] = None, **kwargs):
+        if isinstance(content, EncodedBody):
+            headers = {**(headers or {}), "ETag": content.etag}
+        super().__init__(content, status_code, headers, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, EncodedBody):
+            return content.body
+        with stage_timer("serialize"):
+            return dumps(content)
+
+
+class EncodedCache:
+    """
+    Encoded bodies by key, reused for as long as the source object they were
+    built from (e.g. a cached station list) is the same object. Sources must
+    never be mutated in place. Least recently used keys are evicted past max_entries.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: Hashable, source: Any, build: Callable[[], Any]) -> EncodedBody:
+        """Encoded build() output, re-encoded only when source is a different object"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is source:
+            self.counters["hits"] += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+        self.counters["misses"] += 1
+        encoded = encode(build())
+        self.entries[key] = (source, encoded)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+        return encoded
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "entries": len(self.entries),
+            "bytes": sum(len(encoded.body) for _, encoded in self.entries.values()),
+            "orjson": ORJSON_AVAILABLE,
+        }
@@ -0,0 +1,248 @@
+"""
+Cross-process shared store for multi-worker deployments
+Byte values with TTLs plus named leases for leader election, so one worker
+polls upstreams and every worker reads the same snapshot.
+- LocalStore: in-process, the single-worker default
+- SQLiteStore: a local SQLite file shared by workers on one host
+- RedisStore: any Redis-compatible server (requires the redis package)
+"""
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # only needed for SHARED_CACHE_BACKEND=redis
+    redis_asyncio = None
+
+# (pid, owner id) of the process that last asked; see owner_id()
+_owner = None
+
+
+def owner_id() -> str:
+    """
+    Identifies this process as a lease holder. Derived on use rather than at
+    import, so workers forked after import (e.g. gunicorn --preload) each get
+    their own; the random suffix keeps a reused pid from inheriting a lease.
+    """
+    global _owner
+    pid = os.getpid()
+    if _owner is None or _owner[0] != pid:
+        _owner = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}")
+    return _owner[1]
+
+
+class LocalStore:
+    """Plain dicts; with one process every poller is trivially the leader"""
+
+    shared = False
+    kind = "local"
+
+    def __init__(self):
+        self.values = {}  # key -> (value, expires_at)
+        self.leases = {}  # name -> (owner, expires_at)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self.values[key] = (value, time.time() + ttl)
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease; False while another owner holds it"""
+        now = time.time()
+        holder = self.leases.get(name)
+        if holder is not None and holder[0] != owner and holder[1] >= now:
+            return False
+        self.leases[name] = (owner, now + ttl)
+        return True
+
+    async def release(self, name: str, owner: str):
+        holder = self.leases.get(name)
+        if holder is not None and holder[0] == owner:
+            del self.leases[name]
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.kind, "keys": len(self.values), "leases": len(self.leases)}
+
+
+class SQLiteStore(LocalStore):
+    """
+    SQLite file in WAL mode shared by every worker on the host. Statements can
+    wait up to the busy timeout on another worker's write and snapshots run to
+    tens of KB, so the async methods run in an executor; a lock serializes the
+    worker threads on the one connection, and callers on the event loop run
+    stats() in an executor too. The connection is opened on first use so it is
+    never inherited across fork().
+    """
+
+    shared = True
+    kind = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = None
+        self.lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=1.0)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS lease ("
+                " name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self.db
+
+    @staticmethod
+    async def _run(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            row = self._conn().execute(
+                "SELECT value FROM kv WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: bytes, ttl: float):
+        with self.lock:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+
+    def _acquire(self, name: str, owner: str, ttl: float) -> bool:
+        with self.lock:
+            now = time.time()
+            db = self._conn()
+            # One atomic upsert: only replaces the row if we hold it or it expired
+            db.execute(
+                "INSERT INTO lease (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE lease.owner = excluded.owner OR lease.expires_at < ?",
+                (name, owner, now + ttl, now),
+            )
+            row = db.execute("SELECT owner FROM lease WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def _release(self, name: str, owner: str):
+        with self.lock:
+            self._conn().execute("DELETE FROM lease WHERE name = ? AND owner = ?", (name, owner))
+
+    def _close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._run(self._set, key, value, ttl)
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._run(self._acquire, name, owner, ttl)
+
+    async def release(self, name: str, owner: str):
+        await self._run(self._release, name, owner)
+
+    async def close(self):
+        await self._run(self._close)
+
+    def stats(self) -> dict:
+        with self.lock:
+            db = self._conn()
+            now = time.time()
+            keys = db.execute("SELECT COUNT(*) FROM kv WHERE expires_at >= ?", (now,)).fetchone()[0]
+            leases = db.execute("SELECT name, owner, expires_at FROM lease").fetchall()
+        return {
+            "backend": self.kind,
+            "path": self.path,
+            "keys": keys,
+            "leases": {
+                name: {"owner": owner, "expires_in": round(expires_at - now, 1)}
+                for name, owner, expires_at in leases
+            },
+        }
+
+
+# Set only if KEYS[1] is free or already ours; delete only if ours
+_ACQUIRE = """
+local holder = redis.call('GET', KEYS[1])
+if not holder or holder == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStore(LocalStore):
+    """Redis (or any server speaking its protocol); client can be injected, e.g. a fake for tests"""
+
+    shared = True
+    kind = "redis"
+
+    def __init__(self, url: str, prefix: str = "smartbay:", client=None):
+        if client is None:
+            if redis_asyncio is None:
+                raise RuntimeError("SHARED_CACHE_BACKEND=redis requires the redis package")
+            client = redis_asyncio.Redis.from_url(url)
+        self.url = url
+        self.prefix = prefix
+        self.client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self.client.eval(_ACQUIRE, 1, self.prefix + "lease:" + name, owner, int(ttl * 1000)))
+
+    async def release(self, name: str, owner: str):
+        await self.client.eval(_RELEASE, 1, self.prefix + "lease:" + name, owner)
+
+    async def close(self):
+        await self.client.close()
+
+    def stats(self) -> dict:
+        return {"backend": self.kind, "url": self.url, "prefix": self.prefix}
+
+
+def create_store(backend: str, path: str, url: str) -> LocalStore:
+    """Store for SHARED_CACHE_BACKEND: local, sqlite or redis"""
+    backend = backend.lower()
+    if backend == "sqlite":
+        return SQLiteStore(path)
+    if backend == "redis":
+        return RedisStore(url)
+    if backend != "local":
+        raise ValueError(f"Unknown SHARED_CACHE_BACKEND: {backend}")
+    return LocalStore()
@@ -0,0 +1,143 @@
+"""
+In-memory BART station registry
+abbr -> station lookup plus a lat/lon grid index for nearest-station queries,
+so location lookups never touch the network
+"""
+
+import math
+from typing import Iterable, List, Optional, Tuple
+
+from models import Station
+
+try:
+    import numpy as np
+except ImportError:  # bulk queries fall back to the grid index
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Grid cell size in degrees (~5 km north-south around the Bay Area)
+GRID_CELL_DEGREES = 0.05
+
+# Queries this many cells beyond the station bounding box are answered by a full scan
+MAX_GRID_RINGS = 40
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StationRegistry:
+    """Station lookups by abbreviation and by location"""
+
+    def __init__(self, stations: Iterable[Station] = (), cell: float = GRID_CELL_DEGREES):
+        self.cell = cell
+        self.load(stations)
+
+    def load(self, stations: Iterable[Station]):
+        """(Re)build every index from a list of Station records"""
+        self.stations = [s for s in stations if s.abbr and s.lat and s.lon]
+        self.by_abbr = {s.abbr: s for s in self.stations}
+        self.grid = {}
+        for index, s in enumerate(self.stations):
+            self.grid.setdefault(self._cell_of(s.lat, s.lon), []).append(index)
+        if self.grid:
+            rows = [i for i, _ in self.grid]
+            cols = [j for _, j in self.grid]
+            self.bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self.bounds = (0, 0, 0, 0)
+        if np is not None and self.stations:
+            self.lat_rad = np.radians(np.array([s.lat for s in self.stations]))
+            self.lon_rad = np.radians(np.array([s.lon for s in self.stations]))
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def __contains__(self, abbr: str) -> bool:
+        return abbr in self.by_abbr
+
+    def get(self, abbr: str) -> Optional[Station]:
+        return self.by_abbr.get(abbr)
+
+    def name(self, abbr: str, default: Optional[str] = None) -> Optional[str]:
+        station = self.by_abbr.get(abbr)
+        return station.name if station else default
+
+    def abbrs(self) -> List[str]:
+        return [s.abbr for s in self.stations]
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell), math.floor(lon / self.cell))
+
+    def _ring(self, row: int, col: int, radius: int):
+        """Station indexes in the square ring of cells at Chebyshev distance radius"""
+        if radius == 0:
+            yield from self.grid.get((row, col), ())
+            return
+        for i in range(row - radius, row + radius + 1):
+            step = 1 if i in (row - radius, row + radius) else 2 * radius
+            for j in range(col - radius, col + radius + 1, step):
+                yield from self.grid.get((i, j), ())
+
+    def _scan(self, lat: float, lon: float, k: int) -> List[Tuple[float, int]]:
+        found = sorted((haversine_km(lat, lon, s.lat, s.lon), index) for index, s in enumerate(self.stations))
+        return found[:k]
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[float, Station]]:
+        """k nearest stations as (distance_km, station), closest first"""
+        if not self.stations or k <= 0:
+            return []
+        k = min(k, len(self.stations))
+        row, col = self._cell_of(lat, lon)
+        min_row, max_row, min_col, max_col = self.bounds
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col)
+        if last_ring > MAX_GRID_RINGS:
+            found = self._scan(lat, lon, k)
+        else:
+            found = []
+            # Conservative km per cell: longitude degrees shrink towards the poles
+            km_per_cell = self.cell * KM_PER_DEGREE * math.cos(math.radians(min(89.0, abs(lat) + last_ring * self.cell)))
+            for radius in range(last_ring + 1):
+                for index in self._ring(row, col, radius):
+                    s = self.stations[index]
+                    found.append((haversine_km(lat, lon, s.lat, s.lon), index))
+                found.sort()
+                # Anything in an outer ring is at least radius cells away
+                if len(found) >= k and found[k - 1][0] <= radius * km_per_cell:
+                    break
+        return [(distance, self.stations[index]) for distance, index in found[:k]]
+
+    def nearest_many(self, points: List[Tuple[float, float]], k: int = 1) -> List[List[Tuple[float, Station]]]:
+        """k nearest stations for many (lat, lon) points in one vectorized pass"""
+        if not self.stations or not points or k <= 0:
+            return [[] for _ in points]
+        k = min(k, len(self.stations))
+        if np is None:
+            return [self.nearest(lat, lon, k) for lat, lon in points]
+
+        coords = np.radians(np.asarray(points, dtype=float))
+        lat = coords[:, 0:1]
+        lon = coords[:, 1:2]
+        a = (np.sin((self.lat_rad - lat) / 2) ** 2
+             + np.cos(lat) * np.cos(self.lat_rad) * np.sin((self.lon_rad - lon) / 2) ** 2)
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+        if k < len(self.stations):
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(len(self.stations)), (len(points), 1))
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_distances, axis=1)
+        indexes = np.take_along_axis(candidates, order, axis=1)
+        ordered = np.take_along_axis(candidate_distances, order, axis=1)
+        return [
+            [(float(d), self.stations[i]) for d, i in zip(row_distances, row_indexes)]
+            for row_distances, row_indexes in zip(ordered.tolist(), indexes.tolist())
+        ]
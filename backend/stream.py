@@ -0,0 +1,222 @@
+"""
+Live update hub for Server-Sent Events
+One shared loop loads every key that has at least one subscriber (e.g.
+"departures:EMBR", "weather", "aqi") and pushes an event only when a key's
+payload changes. A new subscriber first gets one snapshot event (key ->
+payload for all its keys). After that, keys with a differ (departures) push
+only what changed and the rest push the whole payload. Each subscriber has a
+bounded queue; a consumer that falls behind has its backlog dropped and
+receives one fresh snapshot instead.
+"""
+
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from models import Record
+from serialize import dumps
+
+# Trains are matched across ticks within one destination, line and platform
+DEPARTURE_GROUP = ("destination", "color", "platform")
+
+# A train's minutes only count down between ticks; an estimate up to this much
+# later (added delay) is still taken to be the same train
+DELAY_TOLERANCE_MINUTES = 2
+
+
+class Subscription:
+    def __init__(self, keys: Iterable[str], queue_size: int):
+        self.keys = frozenset(keys)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.resyncs = 0
+        self.ready = False  # set by StreamHub.prime once the initial snapshot is queued
+
+
+def _match(old: list, new: list) -> int:
+    """How many of old (sorted by minutes) have left: the fewest that lets every later train line up"""
+    for left in range(len(old) + 1):
+        if all(n["minutes"] <= o["minutes"] + DELAY_TOLERANCE_MINUTES for o, n in zip(old[left:], new)):
+            return left
+    return len(old)
+
+
+def diff_departures(previous: Optional[dict], payload: dict, ids: Iterator[int]) -> Tuple[dict, Optional[dict]]:
+    """
+    Differ for departures:<abbr> keys. Returns the state to keep, with an id on
+    every train, and the diff event from previous: {"station_abbr", "added":
+    [trains], "removed": [ids], "changed": [{"id", <changed fields>}]}, or {}
+    if nothing changed. The diff is None when the full payload must be sent
+    instead (first load, or anything but the departures list changed, e.g. a
+    fallback to demo data).
+    """
+    trains = [d.to_dict() if isinstance(d, Record) else dict(d) for d in payload.get("departures", ())]
+    state = {**payload, "departures": trains}
+    rest = {key: value for key, value in payload.items() if key != "departures"}
+    if previous is None or rest != {key: value for key, value in previous.items() if key != "departures"}:
+        for train in trains:
+            train["id"] = next(ids)
+        return state, None
+
+    def groups(items: list) -> dict:
+        grouped = {}
+        for train in sorted(items, key=lambda t: t["minutes"]):
+            grouped.setdefault(tuple(train[name] for name in DEPARTURE_GROUP), []).append(train)
+        return grouped
+
+    old_groups, new_groups = groups(previous["departures"]), groups(trains)
+    added, removed, changed = [], [], []
+    for group in sorted(set(old_groups) | set(new_groups), key=str):
+        old, new = old_groups.get(group, []), new_groups.get(group, [])
+        left = _match(old, new)
+        removed += [train["id"] for train in old[:left]]
+        kept = old[left:]
+        for before, after in zip(kept, new):
+            after["id"] = before["id"]
+            fields = {name: value for name, value in after.items() if before.get(name) != value}
+            if fields:
+                changed.append({"id": after["id"], **fields})
+        removed += [train["id"] for train in kept[len(new):]]
+        for train in new[len(kept):]:
+            train["id"] = next(ids)
+            added.append(train)
+    if not (added or removed or changed):
+        return state, {}
+    return state, {"station_abbr": payload.get("station_abbr"), "added": added, "removed": removed, "changed": changed}
+
+
+class StreamHub:
+    """Shared poll loop plus per-subscriber fan-out with change detection"""
+
+    def __init__(self, load: Callable[[str], Awaitable[dict]], interval: float, queue_size: int = 16,
+                 differs: Optional[Dict[str, Callable]] = None):
+        """differs: event name -> differ (see diff_departures) for keys pushed as diffs"""
+        self.load = load
+        self.interval = interval
+        self.queue_size = queue_size
+        self.differs = differs or {}
+        self.subscriptions = set()
+        self.state = {}
+        self.loaded = {}  # key -> last payload as loaded, for change detection
+        self.ids = itertools.count(1)
+        self.counters = {"ticks": 0, "events": 0, "diffs": 0, "dropped": 0, "resyncs": 0}
+        self.task = None
+
+    def subscribe(self, keys: Iterable[str]) -> Subscription:
+        """Register a subscriber; it gets no events until prime()"""
+        sub = Subscription(keys, self.queue_size)
+        self.subscriptions.add(sub)
+        return sub
+
+    async def prime(self, sub: Subscription):
+        """
+        Load keys nobody has seen yet so a new subscriber doesn't wait a full
+        interval, then queue its snapshot event: always the first it receives
+        """
+        await self.tick([key for key in sub.keys if key not in self.state])
+        sub.ready = True
+        sub.queue.put_nowait(("snapshot", {key: self.state[key] for key in sub.keys if key in self.state}))
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscriptions.discard(sub)
+
+    def _deliver(self, sub: Subscription, event: str, data: dict):
+        try:
+            sub.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # Slow consumer: replace its backlog with a single up-to-date snapshot
+            self.counters["dropped"] += sub.queue.qsize() + 1
+            while not sub.queue.empty():
+                sub.queue.get_nowait()
+            sub.resyncs += 1
+            self.counters["resyncs"] += 1
+            sub.queue.put_nowait(("snapshot", {key: self.state[key] for key in sub.keys if key in self.state}))
+
+    async def tick(self, keys: Iterable[str] = None):
+        """
+        Load subscribed keys (all of them by default) and publish the ones
+        that changed. A full tick also forgets keys nobody subscribes to.
+        """
+        subscribed = set().union(*(sub.keys for sub in self.subscriptions))
+        if keys is None:
+            self.counters["ticks"] += 1
+            for key in list(self.state):
+                if key not in subscribed:
+                    del self.state[key]
+                    self.loaded.pop(key, None)
+            keys = subscribed
+        ordered = sorted(set(keys) & subscribed)
+        if not ordered:
+            return
+
+        payloads = await asyncio.gather(*(self.load(key) for key in ordered), return_exceptions=True)
+        for key, payload in zip(ordered, payloads):
+            if isinstance(payload, BaseException) or self.loaded.get(key) == payload:
+                continue
+            self.loaded[key] = payload
+            event = key.split(":", 1)[0]
+            differ = self.differs.get(event)
+            if differ is None:
+                self.state[key] = payload
+                data = payload
+            else:
+                self.state[key], diff = differ(self.state.get(key), payload, self.ids)
+                data = self.state[key]
+                if diff is not None:
+                    if not diff:
+                        continue
+                    event, data = f"{event}_diff", diff
+                    self.counters["diffs"] += 1
+            for sub in list(self.subscriptions):
+                if sub.ready and key in sub.keys:
+                    self.counters["events"] += 1
+                    self._deliver(sub, event, data)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "interval": self.interval,
+            "subscribers": len(self.subscriptions),
+            "keys": sorted(self.state),
+            **self.counters,
+        }
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+
+async def sse_events(hub: StreamHub, keys: Iterable[str], keepalive: float):
+    """Subscribe to keys and yield SSE frames until the client disconnects"""
+    sub = hub.subscribe(keys)
+    try:
+        yield "retry: 5000\n\n"
+        await hub.prime(sub)
+        while True:
+            try:
+                event, data = await asyncio.wait_for(sub.queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event, data)
+    finally:
+        hub.unsubscribe(sub)
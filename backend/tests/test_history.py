@@ -0,0 +1,164 @@
+"""
+Regression tests for the ETD history day files: repair of partial writes,
+appends from several processes and error containment in record()
+Usage: python -m pytest backend/tests (or python backend/tests/test_history.py)
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from history import COLUMNS, INDEX, HistoryRecorder, _day_name
+from models import Departure
+
+STATIONS = ["EMBR", "MONT", "POWL"]
+TERMINALS = {"Richmond": "RICH", "Daly City": "DALY"}
+
+# Noon UTC on a fixed day, so a test never straddles a day boundary
+DAY_START = 1768392000.0
+
+
+def snapshot(delay: int = 0) -> dict:
+    """Three stations with two estimates each: 6 rows"""
+    return {
+        abbr: {"departures": (
+            Departure("Richmond", 3, "1", "North", 8, "RED", "#ff0000", delay),
+            Departure("Daly City", 7, "2", "South", 10, "GREEN", "#339933", delay),
+        )}
+        for abbr in STATIONS
+    }
+
+
+ROWS = 6
+
+
+def recorder(directory: str) -> HistoryRecorder:
+    return HistoryRecorder(directory, STATIONS, TERMINALS.get, retention_days=3650)
+
+
+def day_files(directory: str) -> dict:
+    day = os.path.join(directory, _day_name(DAY_START))
+    return {name: np.fromfile(os.path.join(day, name), dtype=dtype) for name, dtype in {**COLUMNS, **INDEX}.items()}
+
+
+def assert_consistent(directory: str, snapshots: int):
+    files = day_files(directory)
+    assert len(files["ts"]) == len(files["end"]) == snapshots
+    assert list(files["end"]) == [ROWS * (i + 1) for i in range(snapshots)]
+    for name in COLUMNS:
+        assert len(files[name]) == ROWS * snapshots, name
+
+
+def samples(directory: str) -> int:
+    stats = recorder(directory).delay_stats(DAY_START - 60, DAY_START + 3600)
+    return sum(entry["samples"] for entry in stats)
+
+
+def with_directory(test):
+    def run():
+        directory = tempfile.mkdtemp(prefix="history-test-")
+        try:
+            test(directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    run.__name__ = test.__name__
+    return run
+
+
+@with_directory
+def test_partial_write_is_truncated_on_open(directory):
+    first = recorder(directory)
+    first.record(snapshot(), DAY_START)
+    first.record(snapshot(), DAY_START + 30)
+    first.close()
+
+    # A crash mid-append: some column rows and a ts entry without its end entry
+    day = os.path.join(directory, _day_name(DAY_START))
+    for name, dtype in COLUMNS.items():
+        with open(os.path.join(day, name), "ab") as f:
+            f.write(np.zeros(4, dtype=dtype).tobytes())
+    with open(os.path.join(day, "ts"), "ab") as f:
+        f.write(np.array([int(DAY_START + 60)], dtype=INDEX["ts"]).tobytes())
+    # Readers already ignore the uncommitted rows
+    assert samples(directory) == 2 * ROWS
+
+    second = recorder(directory)
+    second.record(snapshot(), DAY_START + 90)
+    second.close()
+    assert_consistent(directory, 3)
+    assert samples(directory) == 3 * ROWS
+
+
+@with_directory
+def test_writer_with_stale_row_count(directory):
+    # The poller lease moves a -> b -> a: a's cached row count is stale on its return
+    a, b = recorder(directory), recorder(directory)
+    a.record(snapshot(), DAY_START)
+    b.record(snapshot(60), DAY_START + 30)
+    b.record(snapshot(60), DAY_START + 60)
+    a.record(snapshot(), DAY_START + 90)
+    a.close()
+    b.close()
+    assert_consistent(directory, 4)
+    stats = recorder(directory).delay_stats(DAY_START - 60, DAY_START + 3600)
+    assert sum(entry["samples"] for entry in stats) == 4 * ROWS
+    assert all(entry["delayed_share"] == 0.5 for entry in stats)
+
+
+@with_directory
+def test_concurrent_processes(directory):
+    if not hasattr(os, "fork"):
+        return
+    children = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                writer = recorder(directory)
+                for i in range(25):
+                    writer.record(snapshot(), DAY_START + i)
+                writer.close()
+                status = 0 if writer.counters["failures"] == 0 else 1
+            finally:
+                os._exit(status)
+        children.append(pid)
+    for pid in children:
+        assert os.waitpid(pid, 0)[1] == 0
+    assert_consistent(directory, 100)
+    assert samples(directory) == 100 * ROWS
+
+
+@with_directory
+def test_record_never_raises(directory):
+    day = os.path.join(directory, _day_name(DAY_START))
+    os.makedirs(day)
+    with open(os.path.join(day, "schema.json"), "w") as f:
+        json.dump({"version": 1}, f)  # no stations or colors
+    broken = recorder(directory)
+    broken.record(snapshot(), DAY_START)
+    broken.record(snapshot(), DAY_START + 30)
+    assert broken.counters["failures"] == 2
+    assert broken.counters["snapshots"] == 0
+    assert broken.last_error.startswith("KeyError")
+
+    # A healthy day afterwards records normally
+    broken.record(snapshot(), DAY_START + 86400)
+    assert broken.counters["snapshots"] == 1
+    broken.close()
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"ok  {test.__name__}")
+    print(f"{len(tests)} passed in {time.perf_counter() - start:.2f}s")
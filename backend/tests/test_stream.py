@@ -0,0 +1,152 @@
+"""
+Regression tests for the SSE hub: the first event a subscriber gets, and
+departures diffs that a client can apply to stay in step with the hub
+Usage: python -m pytest backend/tests (or python backend/tests/test_stream.py)
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+from dataclasses import replace
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import Departure
+from serialize import dumps
+from stream import StreamHub, diff_departures
+
+LINES = [
+    ("Richmond", "1", "North", "RED", "#ff0000"),
+    ("Millbrae", "2", "South", "RED", "#ff0000"),
+    ("Antioch", "1", "North", "YELLOW", "#ffff33"),
+    ("SF Airport", "2", "South", "YELLOW", "#ffff33"),
+    ("Dublin/Pleasanton", "1", "North", "BLUE", "#0099cc"),
+]
+
+
+def board(rng: random.Random) -> list:
+    """Three trains per line, 2-59 minutes out"""
+    return [
+        Departure(destination, minutes, platform, direction, rng.choice((6, 8, 10)), color, hexcolor, 0)
+        for destination, platform, direction, color, hexcolor in LINES
+        for minutes in sorted(rng.sample(range(2, 60), 3))
+    ]
+
+
+def advance(departures: list, rng: random.Random) -> list:
+    """One minute later: trains count down (some pick up a delay), leave at 0, and new ones appear"""
+    later = []
+    for d in departures:
+        delayed = rng.random() < 0.05
+        minutes = d.minutes - 1 + (3 if delayed else 0)
+        if minutes >= 0:
+            later.append(replace(d, minutes=minutes, delay=d.delay + (180 if delayed else 0)))
+    if rng.random() < 0.3:
+        later.append(replace(rng.choice(departures or board(rng)), minutes=rng.randrange(40, 60), delay=0))
+    return sorted(later, key=lambda d: d.minutes)
+
+
+def received(sub) -> list:
+    """Drain a subscription as a client would see it: through JSON"""
+    events = []
+    while not sub.queue.empty():
+        event, data = sub.queue.get_nowait()
+        events.append((event, orjson.loads(dumps(data))))
+    return events
+
+
+def comparable(trains, ids: bool = True) -> list:
+    return sorted(orjson.dumps({k: v for k, v in t.items() if ids or k != "id"}, option=orjson.OPT_SORT_KEYS)
+                  for t in trains)
+
+
+def test_countdown_diffs_track_the_hub():
+    rng = random.Random(1)
+    key = "departures:EMBR"
+    current = {"source": "live", "station_abbr": "EMBR", "departures": board(rng)}
+
+    async def load(_key):
+        return {**current, "departures": tuple(current["departures"])}
+
+    async def run():
+        hub = StreamHub(load, 1, differs={"departures": diff_departures})
+        sub = hub.subscribe([key])
+        await hub.prime(sub)
+        client, counts = {}, {}
+        for step in range(120):
+            for event, data in received(sub):
+                counts[event] = counts.get(event, 0) + 1
+                if event == "snapshot":
+                    client = {t["id"]: t for t in data[key]["departures"]}
+                elif event == "departures":
+                    client = {t["id"]: t for t in data["departures"]}
+                else:
+                    assert event == "departures_diff"
+                    for train_id in data["removed"]:
+                        del client[train_id]
+                    for change in data["changed"]:
+                        client[change["id"]].update(change)
+                    for train in data["added"]:
+                        client[train["id"]] = train
+            assert comparable(client.values()) == comparable(hub.state[key]["departures"]), step
+            assert comparable(client.values(), ids=False) == comparable(
+                [d.to_dict() for d in current["departures"]], ids=False), step
+            if step == 60:
+                # Anything outside the departure list changing resends the whole payload
+                current["source"] = "demo"
+            current["departures"] = advance(current["departures"], rng)
+            await hub.tick()
+        return hub, counts
+
+    hub, counts = asyncio.run(run())
+    assert counts["snapshot"] == 1
+    assert counts["departures"] == 1
+    assert counts["departures_diff"] > 100
+    assert hub.counters["resyncs"] == 0
+
+
+def test_first_event_is_always_a_snapshot():
+    payloads = {"weather": {"temp_c": 14.0}, "departures:EMBR": {"station_abbr": "EMBR", "departures": ()}}
+    loads = []
+
+    async def load(key):
+        loads.append(key)
+        return payloads[key]
+
+    async def run():
+        hub = StreamHub(load, 1, differs={"departures": diff_departures})
+        # Cold: nothing loaded yet, so prime() loads both keys
+        cold = hub.subscribe(["weather", "departures:EMBR"])
+        await hub.prime(cold)
+        # Hot: both keys already in the hub, so prime() loads nothing
+        hot = hub.subscribe(["weather", "departures:EMBR"])
+        await hub.prime(hot)
+        # A key that fails to load is left out of the snapshot...
+        watcher = hub.subscribe(["aqi"])
+        await hub.prime(watcher)
+        # ...and when a later subscriber loads it, those already streaming get a normal event
+        payloads["aqi"] = {"aqi": 42}
+        partial = hub.subscribe(["weather", "aqi"])
+        await hub.prime(partial)
+        return [received(sub) for sub in (cold, hot, partial, watcher)]
+
+    cold, hot, partial, watcher = asyncio.run(run())
+    both = {"weather": payloads["weather"], "departures:EMBR": {"station_abbr": "EMBR", "departures": []}}
+    assert cold == [("snapshot", both)]
+    assert hot == [("snapshot", both)]
+    assert partial == [("snapshot", {"weather": payloads["weather"], "aqi": payloads["aqi"]})]
+    assert watcher == [("snapshot", {}), ("aqi", payloads["aqi"])]
+    assert loads == ["departures:EMBR", "weather", "aqi", "aqi"]
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"ok  {test.__name__}")
+    print(f"{len(tests)} passed in {time.perf_counter() - start:.2f}s")
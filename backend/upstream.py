@@ -0,0 +1,287 @@
+"""
+Upstream HTTP connection pooling
+One long-lived httpx.AsyncClient per upstream host, opened and closed by the app lifespan,
+with request coalescing and a circuit breaker per host
+"""
+
+import asyncio
+import importlib.util
+import os
+import socket
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import UPSTREAM_LATENCY
+
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Pool limits shared by every upstream host (tunable via environment)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+
+# Circuit breaker: trip when at least BREAKER_MIN_CALLS of the last BREAKER_WINDOW
+# calls were made and BREAKER_FAILURE_RATE of them failed; stay open for
+# BREAKER_OPEN_SECONDS, doubling after each failed probe up to BREAKER_MAX_OPEN_SECONDS
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "5"))
+BREAKER_MAX_OPEN_SECONDS = float(os.getenv("BREAKER_MAX_OPEN_SECONDS", "300"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker over a sliding window of call outcomes.
+    While open, calls are rejected immediately; once the open period ends a
+    single probe call is let through (half-open) and decides whether to close
+    again or re-open with a doubled backoff.
+    """
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, open_seconds: float = BREAKER_OPEN_SECONDS,
+                 max_open_seconds: float = BREAKER_MAX_OPEN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.latencies = deque(maxlen=100)  # seconds, recent calls regardless of outcome
+        self.backoff = open_seconds
+        self.open_until = 0.0
+        self.probing = False
+        self.last_error = None
+        self.counters = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now; claims the probe slot when half-open"""
+        if self.state == OPEN:
+            if time.monotonic() < self.open_until:
+                self.counters["rejected"] += 1
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            if self.probing:
+                self.counters["rejected"] += 1
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok: bool, latency: float, error: Optional[str] = None):
+        self.counters["calls"] += 1
+        self.latencies.append(latency)
+        if not ok:
+            self.counters["failures"] += 1
+            self.last_error = error
+
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if ok:
+                self.state = CLOSED
+                self.outcomes.clear()
+                self.backoff = self.open_seconds
+            else:
+                self.backoff = min(self.backoff * 2, self.max_open_seconds)
+                self._open()
+            return
+
+        self.outcomes.append(ok)
+        failures = self.outcomes.count(False)
+        if (self.state == CLOSED and len(self.outcomes) >= self.min_calls
+                and failures / len(self.outcomes) >= self.failure_rate):
+            self._open()
+
+    def release(self):
+        """Give up a probe slot without an outcome (e.g. the call was cancelled)"""
+        self.probing = False
+
+    def _open(self):
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.backoff
+        self.counters["opened"] += 1
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        outcomes = len(self.outcomes)
+        return {
+            "state": self.state,
+            "error_rate": round(self.outcomes.count(False) / outcomes, 3) if outcomes else 0.0,
+            "window_calls": outcomes,
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else None,
+            "retry_in": round(max(0.0, self.open_until - time.monotonic()), 1) if self.state == OPEN else 0.0,
+            "backoff": self.backoff,
+            "last_error": self.last_error,
+            **self.counters,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing a key into one in-flight task.
+    The shared task is shielded, so a cancelled caller (e.g. a dropped
+    client connection) does not cancel the call for everyone else.
+    With cancel_orphans, the task is cancelled once every caller is gone,
+    for calls only worth finishing for someone waiting (e.g. a queued,
+    rate-limited request).
+    """
+
+    def __init__(self, cancel_orphans: bool = False):
+        self.cancel_orphans = cancel_orphans
+        self.calls = {}
+        self.callers = {}  # task -> callers still awaiting it
+        self.counters = {"leaders": 0, "followers": 0, "orphaned": 0}
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.counters["leaders"] += 1
+        else:
+            self.counters["followers"] += 1
+        self.callers[task] = self.callers.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.callers[task] -= 1
+            if not self.callers[task]:
+                del self.callers[task]
+                if self.cancel_orphans and not task.done():
+                    task.cancel()
+                    self.counters["orphaned"] += 1
+
+    def _forget(self, key, task: asyncio.Future):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the result as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {**self.counters, "in_flight": len(self.calls)}
+
+
+class UpstreamPool:
+    """Registry of pooled clients keyed by upstream name (bart, open_meteo, ...)"""
+
+    def __init__(self, headers: Optional[dict] = None):
+        self.headers = headers or {}
+        self.hosts = {}
+        self.clients = {}
+        self.breakers = {}
+        self.flights = SingleFlight()
+
+    def register(self, name: str, base_url: str, timeout: float = 15.0, http2: bool = False):
+        """Declare an upstream host; its client is created on start() or first use"""
+        self.hosts[name] = {
+            "base_url": base_url,
+            "timeout": timeout,
+            # HTTP/2 only over TLS and only when h2 is installed
+            "http2": http2 and HTTP2_AVAILABLE and base_url.startswith("https://"),
+        }
+        self.breakers[name] = CircuitBreaker()
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        host = self.hosts[name]
+        return httpx.AsyncClient(
+            headers=self.headers,
+            http2=host["http2"],
+            timeout=httpx.Timeout(host["timeout"], connect=min(UPSTREAM_CONNECT_TIMEOUT, host["timeout"])),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the shared client for an upstream, creating it lazily if needed"""
+        client = self.clients.get(name)
+        if client is None or client.is_closed:
+            client = self.clients[name] = self._build(name)
+        return client
+
+    async def fetch(self, name: str, url: str, params: Optional[dict] = None,
+                    headers: Optional[dict] = None) -> httpx.Response:
+        """
+        GET through the upstream's shared client. Identical concurrent
+        requests (same upstream, URL and params) share one upstream call.
+        Raises CircuitOpenError without calling out while the host's circuit is open.
+        """
+        key = (name, url, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+        return await self.flights.do(key, lambda: self._call(name, url, params, headers))
+
+    async def _call(self, name: str, url: str, params: Optional[dict], headers: Optional[dict]) -> httpx.Response:
+        breaker = self.breakers[name]
+        if not breaker.allow():
+            raise CircuitOpenError(f"{name} circuit open, retrying in {breaker.stats()['retry_in']}s")
+
+        start = time.monotonic()
+        try:
+            response = await self.get(name).get(url, params=params, headers=headers)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            latency = time.monotonic() - start
+            breaker.record(False, latency, str(e) or type(e).__name__)
+            UPSTREAM_LATENCY.observe(latency, upstream=name, outcome="error")
+            raise
+
+        # Server errors, throttling and HTML challenge pages count against the upstream
+        failed = (response.status_code >= 500 or response.status_code == 429
+                  or "text/html" in response.headers.get("content-type", ""))
+        latency = time.monotonic() - start
+        breaker.record(not failed, latency, f"HTTP {response.status_code}" if failed else None)
+        UPSTREAM_LATENCY.observe(latency, upstream=name, outcome="error" if failed else "ok")
+        return response
+
+    async def start(self):
+        """Open a client for every registered upstream"""
+        for name in self.hosts:
+            self.get(name)
+
+    async def resolve(self, name: str) -> int:
+        """
+        Look up an upstream's host name, warming the system resolver cache
+        ahead of the first connection. Returns the number of addresses.
+        """
+        url = urlsplit(self.hosts[name]["base_url"])
+        port = url.port or (443 if url.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(url.hostname, port, type=socket.SOCK_STREAM)
+        return len(addresses)
+
+    async def close(self):
+        """Close all clients, releasing pooled connections"""
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def info(self) -> dict:
+        """Pool configuration and circuit health per upstream, for diagnostics"""
+        return {
+            name: {
+                "base_url": host["base_url"],
+                "timeout": host["timeout"],
+                "http2": host["http2"],
+                "open": name in self.clients and not self.clients[name].is_closed,
+                "circuit": self.breakers[name].stats(),
+            }
+            for name, host in self.hosts.items()
+        }
@@ -0,0 +1,99 @@
+"""
+Startup warm-up and readiness
+Runs named async steps (upstream prefetches, DNS lookups) concurrently at boot
+under a deadline and records how long each took. The readiness probe reports
+ready once every step has finished or the deadline has passed; steps still
+running at the deadline carry on in the background.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from metrics import REGISTRY
+
+WARMUP_STEP_SECONDS = REGISTRY.gauge("warmup_step_seconds", "Duration of each startup warm-up step", ("step", "status"))
+
+# uvicorn's logger, so the summary shows up in the server log
+logger = logging.getLogger("uvicorn.error")
+
+
+class WarmUp:
+    """Concurrent startup steps with a shared deadline"""
+
+    def __init__(self, deadline: float):
+        """deadline: seconds to wait before reporting ready; 0 reports ready at once"""
+        self.deadline = deadline
+        self.steps = {}
+        self.results = {}
+        self.tasks = []
+        self.runner = None
+        self.started_at = None
+        self.elapsed = None  # seconds until every step finished or the deadline passed
+        self.done = False
+        self.stopping = False
+
+    def add(self, name: str, fn: Callable[[], Awaitable]):
+        self.steps[name] = fn
+
+    @property
+    def ready(self) -> bool:
+        return self.done and not self.stopping
+
+    async def _step(self, name: str, fn: Callable[[], Awaitable]):
+        start = time.monotonic()
+        self.results[name] = {"status": "running", "ms": None, "error": None}
+        try:
+            await fn()
+            status, error = "ok", None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status, error = "error", str(e) or type(e).__name__
+        elapsed = time.monotonic() - start
+        self.results[name] = {"status": status, "ms": round(elapsed * 1000, 1), "error": error}
+        WARMUP_STEP_SECONDS.set(round(elapsed, 4), step=name, status=status)
+
+    async def run(self):
+        """Run every step; returns at the deadline even if some are still running"""
+        self.started_at = time.monotonic()
+        self.tasks = [asyncio.create_task(self._step(name, fn)) for name, fn in self.steps.items()]
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=max(self.deadline, 0))
+        self.elapsed = time.monotonic() - self.started_at
+        self.done = True
+        logger.info("Warm-up %s in %.0f ms: %s", "finished" if self.complete else "deadline reached",
+                    self.elapsed * 1000, ", ".join(f"{name} {self._describe(r)}" for name, r in self.results.items()))
+
+    @property
+    def complete(self) -> bool:
+        return all(task.done() for task in self.tasks)
+
+    @staticmethod
+    def _describe(result: dict) -> str:
+        if result["status"] == "running":
+            return "still running"
+        return f"{result['status']} {result['ms']:.0f} ms"
+
+    def start(self):
+        """Run in the background, so boot is never blocked by a slow upstream"""
+        if self.runner is None:
+            self.runner = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Report not ready (so load balancers drain) and cancel unfinished steps"""
+        self.stopping = True
+        tasks = [self.runner, *self.tasks] if self.runner is not None else self.tasks
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "deadline": self.deadline,
+            "elapsed_ms": round(self.elapsed * 1000, 1) if self.elapsed is not None else None,
+            "complete": self.complete,
+            "steps": self.results,
+        }
@@ -22,8 +22,7 @@ function App() {
     // Fetch BART stations on mount
     useEffect(() => {
         fetchStations();
-        fetchWeather();
-        fetchAqi();
+        fetchConditions();
     }, []);
 
     // Fetch departures when station is selected
@@ -69,43 +68,30 @@ function App() {
         }
     };
 
-    const fetchWeather = async () => {
+    // Weather and AQI arrive together; each side can fail independently
+    const fetchConditions = async () => {
         try {
-            setLoading(prev => ({ ...prev, weather: true }));
-            setError(prev => ({ ...prev, weather: null }));
+            setLoading(prev => ({ ...prev, weather: true, aqi: true }));
+            setError(prev => ({ ...prev, weather: null, aqi: null }));
 
-            const response = await fetch(`${API_BASE}/api/weather`);
-            if (!response.ok) {
-                const errData = await response.json();
-                throw new Error(errData.detail || 'Failed to fetch weather');
-            }
+            const response = await fetch(`${API_BASE}/api/conditions`);
+            if (!response.ok) throw new Error('Failed to fetch weather');
 
             const data = await response.json();
-            setWeather(data);
-        } catch (err) {
-            setError(prev => ({ ...prev, weather: err.message }));
-        } finally {
-            setLoading(prev => ({ ...prev, weather: false }));
-        }
-    };
-
-    const fetchAqi = async () => {
-        try {
-            setLoading(prev => ({ ...prev, aqi: true }));
-            setError(prev => ({ ...prev, aqi: null }));
-
-            const response = await fetch(`${API_BASE}/api/aqi`);
-            if (!response.ok) {
-                const errData = await response.json();
-                throw new Error(errData.detail || 'Failed to fetch AQI');
+            if (data.weather?.success) {
+                setWeather(data.weather);
+            } else {
+                setError(prev => ({ ...prev, weather: data.weather?.error || 'Failed to fetch weather' }));
+            }
+            if (data.aqi?.success) {
+                setAqi(data.aqi);
+            } else {
+                setError(prev => ({ ...prev, aqi: data.aqi?.error || 'Failed to fetch AQI' }));
             }
-
-            const data = await response.json();
-            setAqi(data);
         } catch (err) {
-            setError(prev => ({ ...prev, aqi: err.message }));
+            setError(prev => ({ ...prev, weather: err.message, aqi: err.message }));
         } finally {
-            setLoading(prev => ({ ...prev, aqi: false }));
+            setLoading(prev => ({ ...prev, weather: false, aqi: false }));
         }
     };
 
@@ -52,11 +52,11 @@ function TrainArrivals({ departures, stationName, loading, error, onRefresh }) {
                                 </div>
                             </div>
                             <div className="departure-time">
-                                <span className={`departure-minutes ${departure.minutes === 'Leaving' ? 'arriving' : ''}`}>
-                                    {departure.minutes === 'Leaving' ? 'NOW' : departure.minutes}
+                                <span className={`departure-minutes ${departure.minutes === 0 ? 'arriving' : ''}`}>
+                                    {departure.minutes === 0 ? 'NOW' : departure.minutes}
                                 </span>
                                 <span className="departure-label">
-                                    {departure.minutes === 'Leaving' ? 'Departing' : 'min'}
+                                    {departure.minutes === 0 ? 'Departing' : 'min'}
                                 </span>
                             </div>
                         </div>